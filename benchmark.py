@@ -0,0 +1,269 @@
+"""
+benchmark.py
+
+Program to benchmark the phasing algorithms over sweeps of parameters
+
+Every combination of data source, n, m, p and algorithm is one configuration. Each configuration
+runs in its own process (so its peak memory can be measured), with a fixed seed for the random
+data, some warmup runs and then a number of timed repetitions. We report the median and
+interquartile range of the timings along with the accuracy and parsimony, as JSON or CSV
+With --compare, the results are checked against a saved baseline run and slowdowns are flagged
+With --check-time-limit, we instead check that the exact algorithms return within about their
+time limit (-t, default 0.5 s) on a large cohort of distinct genotypes
+
+e.g. python benchmark.py -n 25 -m 4 8 12 -p 4 -a greedy incremental-greedy --repeat 5 -o base.json
+     python benchmark.py -n 25 -m 4 8 12 -p 4 -a greedy incremental-greedy --repeat 5 --compare base.json
+     python benchmark.py --check-time-limit -t 0.5 --packed
+
+Author: Ryan Baker
+"""
+
+from phaserunner import PhaseRunner, EXACT_ALGORITHMS
+from genotype import Genotype
+from timeit import default_timer as timer
+import Queue
+import argparse
+import csv
+import json
+import multiprocessing
+import random
+import resource
+import sys
+
+# Columns of the CSV output (the JSON output also has the list of individual timings)
+COLUMNS = ["source", "n", "m", "p", "algorithm", "packed", "time_limit", "seed", "repeat", "warmup",
+        "median", "iqr", "min", "max", "peak_rss_kb",
+        "correct_phases", "total_phases", "accuracy", "parsimony", "real_parsimony", "lower_bound", "optimal", "error"]
+
+# The q-th quantile (0 <= q <= 1) of a sorted list, interpolating between neighbours
+def quantile(values, q):
+    position = q * (len(values) - 1)
+    below = int(position)
+    above = min(below + 1, len(values) - 1)
+    return values[below] + (values[above] - values[below]) * (position - below)
+
+# Run one configuration (in a child process), putting its result record on the queue
+def run_configuration(config, queue):
+    try:
+        pr = PhaseRunner(config["packed"])
+        use_random = config["source"] == "random"
+        # for random data, the hapmap file is only used as reference data by hash
+        hapmapfile = config["reference"] if use_random else config["source"]
+        times = []
+        parsimonies = []
+        # whether every timed run is known to be optimal: an exact algorithm finished within the time
+        # limit, or the parsimony matches the lower bound (None if unknown)
+        optimal = None
+        for i in xrange(config["warmup"] + config["repeat"]):
+            # the same seed every time, so every repetition phases the same data
+            random.seed(config["seed"])
+            t, acc, pars, real_phase_data, phasing = pr.run(config["algorithm"], config["n"], config["m"],
+                    hapmapfile, use_random, config["p"], config["time_limit"])
+            if i >= config["warmup"]:
+                times.append(t)
+                parsimonies.append(pars[0])
+                if pr.optimal is not None:
+                    optimal = pr.optimal and optimal is not False
+        # the lower bound only depends on the data, so it is computed once, after the timed runs
+        lower_bound = None
+        if config.get("bound"):
+            lower_bound = pr.phaser.lower_bound(pr.to_genotypes(real_phase_data))
+            if max(parsimonies) <= lower_bound:
+                optimal = True
+        times.sort()
+        result = dict(config)
+        result.update({
+            "times": times,
+            "median": quantile(times, 0.5),
+            "iqr": quantile(times, 0.75) - quantile(times, 0.25),
+            "min": times[0],
+            "max": times[-1],
+            "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "correct_phases": acc[0],
+            "total_phases": acc[1],
+            "accuracy": acc[2],
+            "parsimony": pars[0],
+            "real_parsimony": pars[1],
+            "lower_bound": lower_bound,
+            "optimal": optimal,
+            "error": None,
+        })
+    except Exception as e:
+        result = dict(config)
+        result["error"] = "%s: %s" % (type(e).__name__, e)
+    queue.put(result)
+
+# Run one configuration in a fresh process and return its result record
+# If the process dies without a result (e.g. killed for running out of memory), the record has the
+# error instead, so the sweep goes on
+def benchmark(config):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_configuration, args=(config, queue))
+    process.start()
+    result = None
+    while result is None:
+        try:
+            result = queue.get(timeout=1)
+        except Queue.Empty:
+            if process.is_alive():
+                continue
+            # the result may still be on its way if the process only just exited
+            try:
+                result = queue.get(timeout=1)
+            except Queue.Empty:
+                result = dict(config)
+                if process.exitcode < 0:
+                    result["error"] = "process killed by signal %d" % -process.exitcode
+                else:
+                    result["error"] = "process exited with code %d and no result" % process.exitcode
+    process.join()
+    return result
+
+# All the configurations of a sweep
+def configurations(args):
+    configs = []
+    for source in args.data:
+        for n in args.n:
+            for m in args.m:
+                # p only matters for random data
+                for p in (args.p if source == "random" else [None]):
+                    if p is not None and p > 2 ** m:
+                        continue
+                    for algorithm in args.algorithms:
+                        # hash on random data needs a hapmap file for its reference data
+                        if source == "random" and algorithm == "hash" and args.file is None:
+                            continue
+                        configs.append({"source": source, "n": n, "m": m, "p": p, "algorithm": algorithm,
+                                "packed": args.packed, "time_limit": args.time_limit, "seed": args.seed, "repeat": args.repeat,
+                                "warmup": args.warmup, "reference": args.file, "bound": args.bound})
+    return configs
+
+# Individuals and SNPs of the cohort for --check-time-limit: random genotypes, so nearly all of them
+# are distinct and have a dozen or so ambiguous sites, and every exact algorithm has far more to do
+# (phase enumeration, the greedy phasing, the lower bound) than fits in a short time limit
+CHECK_COHORT = (4000, 20)
+
+# Run each exact algorithm with a time limit on the CHECK_COHORT cohort
+# Returns a list of (algorithm, elapsed seconds, whether it kept to the limit), allowing slack for
+# returning the phasing (half the limit, and at least a quarter of a second)
+def check_time_limit(time_limit, packed=False, seed=0):
+    n, m = CHECK_COHORT
+    random.seed(seed)
+    genotypes = [Genotype([random.randrange(3) for x in xrange(m)]) for i in xrange(n)]
+    pr = PhaseRunner(packed)
+    checks = []
+    for algorithm in EXACT_ALGORITHMS:
+        start_time = timer()
+        pr.exact_algorithm(algorithm, time_limit)(genotypes)
+        elapsed_time = timer() - start_time
+        checks.append((algorithm, elapsed_time, elapsed_time <= time_limit + max(time_limit / 2, 0.25)))
+    return checks
+
+# Key identifying the configuration of a result record (for comparing runs)
+def configuration_key(result):
+    return (result["source"], result["n"], result["m"], result["p"], result["algorithm"], result["packed"],
+            result.get("time_limit"))
+
+# Compare results against a baseline run
+# Returns a list of (result, baseline result, ratio) for configurations whose median time went up
+# by more than the threshold (e.g. 0.1 for 10%)
+def regressions(results, baseline, threshold):
+    baseline_results = dict((configuration_key(b), b) for b in baseline if not b.get("error"))
+    slower = []
+    for result in results:
+        base = baseline_results.get(configuration_key(result))
+        if result.get("error") or base is None or base["median"] <= 0:
+            continue
+        ratio = result["median"] / base["median"]
+        if ratio > 1 + threshold:
+            slower.append((result, base, ratio))
+    return slower
+
+def write_results(results, out, output_format):
+    if output_format == "json":
+        json.dump(results, out, indent=2, sort_keys=True)
+        out.write("\n")
+    else:
+        writer = csv.writer(out)
+        writer.writerow(COLUMNS)
+        for result in results:
+            writer.writerow([result.get(column) for column in COLUMNS])
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Benchmark the haplotype phasing algorithms")
+    parser.add_argument("-n", type=int, nargs="+", default=[25],
+                    help="numbers of individuals to sweep over")
+    parser.add_argument("-m", type=int, nargs="+", default=[2, 4, 6, 8],
+                    help="numbers of SNPs to sweep over")
+    parser.add_argument("-p", type=int, nargs="+", default=[4],
+                    help="haplotype pool sizes to sweep over (random data only)")
+    parser.add_argument("-a", "--algorithms", nargs="+", default=["greedy", "hash"],
+                    help="algorithms to sweep over (exhaustive, branch-and-bound, ilp, greedy, incremental-greedy, clark, em, hash)")
+    parser.add_argument("-d", "--data", nargs="+", default=["random"],
+                    help="data sources to sweep over: 'random' or hapmap file names (hash needs a hapmap file for its reference data either way)")
+    parser.add_argument("-f", "--file",
+                    help="hapmap file for the hash reference data when the data source is random")
+    parser.add_argument("--seed", type=int, default=0,
+                    help="random seed (default 0)")
+    parser.add_argument("--repeat", type=int, default=5,
+                    help="number of timed repetitions per configuration (default 5)")
+    parser.add_argument("--warmup", type=int, default=1,
+                    help="number of untimed warmup runs per configuration (default 1)")
+    parser.add_argument("--packed", action="store_true",
+                    help="use bit-packed haplotypes/genotypes internally")
+    parser.add_argument("-t", "--time-limit", type=float,
+                    help="time limit in seconds for each run of the exact algorithms (exhaustive, branch-and-bound, ilp); the results say whether they finished")
+    parser.add_argument("--bound", action="store_true",
+                    help="also compute a lower bound on the parsimony of each configuration's data, which proves its phasing optimal if they match")
+    parser.add_argument("--format", choices=["json", "csv"], default="json",
+                    help="output format (default json)")
+    parser.add_argument("-o", "--output",
+                    help="output file (default stdout)")
+    parser.add_argument("--compare",
+                    help="baseline JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                    help="relative slowdown of the median time counted as a regression (default 0.1)")
+    parser.add_argument("--check-time-limit", action="store_true",
+                    help="instead of a sweep, check that the exact algorithms return within about the time limit (-t, default 0.5) on %d distinct genotypes over %d SNPs" % CHECK_COHORT)
+
+    args = parser.parse_args()
+
+    if args.check_time_limit:
+        time_limit = 0.5 if args.time_limit is None else args.time_limit
+        checks = check_time_limit(time_limit, args.packed, args.seed)
+        for algorithm, elapsed_time, ok in checks:
+            sys.stderr.write("%s%s: %g s with a time limit of %g s\n" % ("" if ok else "OVERRUN ", algorithm,
+                    elapsed_time, time_limit))
+        if not all(ok for algorithm, elapsed_time, ok in checks):
+            sys.exit(1)
+        return
+
+    results = []
+    for config in configurations(args):
+        result = benchmark(config)
+        results.append(result)
+        # progress goes to stderr, so that stdout is just the results
+        if result["error"]:
+            sys.stderr.write("%s n=%d m=%d %s: %s\n" % (config["source"], config["n"], config["m"], config["algorithm"], result["error"]))
+        else:
+            sys.stderr.write("%s n=%d m=%d %s: median %g s%s\n" % (config["source"], config["n"], config["m"], config["algorithm"], result["median"],
+                    " (time limit reached)" if result["optimal"] is False else ""))
+
+    if args.output:
+        out = open(args.output, "w")
+        write_results(results, out, args.format)
+        out.close()
+    else:
+        write_results(results, sys.stdout, args.format)
+
+    if args.compare:
+        slower = regressions(results, json.load(open(args.compare)), args.threshold)
+        for result, base, ratio in slower:
+            sys.stderr.write("REGRESSION %s n=%d m=%d %s: median %g s vs %g s (%.2fx)\n" % (result["source"],
+                    result["n"], result["m"], result["algorithm"], result["median"], base["median"], ratio))
+        if slower:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
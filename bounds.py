@@ -0,0 +1,125 @@
+"""
+bounds.py
+
+Module for lower bounds on the minimum parsimony of phasing a set of (packed) genotypes
+
+Any phasing must use
+    - the forced haplotypes: a genotype with at most one ambiguous site has only one phase,
+      so both of its haplotypes are in every phasing
+    - disjoint sets of haplotypes for incompatible genotypes: a haplotype explaining two genotypes
+      must agree with both wherever they are homozygous, so genotypes which are homozygous for
+      different alleles at some site cannot share a haplotype. A homozygous genotype needs one
+      haplotype and any other genotype two, so a set of pairwise incompatible genotypes needs at
+      least that many haplotypes between them
+Both combine: a forced haplotype explaining none of the genotypes of such a set is not one of
+their haplotypes, so it counts on top. The bound is the best of this over a few greedily grown
+sets of pairwise incompatible genotypes (finding the best such set is a maximum weight clique
+problem, so we settle for greedy ones). The incompatibilities are kept as one bitset per genotype,
+so this takes O(nm) operations on n bit integers plus O(n) per seed, rather than n^2 tests
+With a deadline, the bound is cut short once it passes: it is then the best bound of the seeds
+done so far, or just the number of forced haplotypes
+
+Author: Ryan Baker
+"""
+
+from timelimit import TimeLimitReached, until_deadline
+import time
+
+# Raised inside a search once its best phasing matches the lower bound, so nothing better is left to find
+class BoundReached(Exception):
+    pass
+
+# Whether some haplotype explains both genotypes (they are never homozygous for different alleles)
+def compatible(one, two):
+    return not (one.alt & two.ref or one.ref & two.alt)
+
+# Number of haplotypes any phasing uses for a genotype (1 if it is homozygous everywhere, else 2)
+def weight(genotype):
+    return 1 if genotype.het == 0 else 2
+
+# The haplotypes which are in every phasing of the genotypes, as a dictionary mapping the bits of
+# each one to the index of a genotype it is forced by
+def forced_haplotypes(genotypes):
+    forced = {}
+    for i, g in enumerate(genotypes):
+        if g.het & (g.het - 1) == 0:
+            forced.setdefault(g.alt, i)
+            forced.setdefault(g.alt | g.het, i)
+    return forced
+
+# The positions of the 1 bits of an integer, lowest first
+def set_bits(bits):
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+# For each genotype, the set of genotypes it is incompatible with, as a bitset (bit j for genotype j)
+# These are built from the sets of genotypes homozygous REF and homozygous ALT at each site, so it
+# takes O(nm) operations on n bit integers rather than n^2 compatible tests
+# Raises TimeLimitReached once the deadline (a time.time() value, if any) has passed
+def incompatible_sets(genotypes, deadline=None):
+    homozygous_ref = {}     # maps site bit position to the bitset of genotypes homozygous REF there
+    homozygous_alt = {}     # and the same for ALT
+    for j, g in until_deadline(enumerate(genotypes), deadline, 256):
+        for x in set_bits(g.ref):
+            homozygous_ref[x] = homozygous_ref.get(x, 0) | (1 << j)
+        for x in set_bits(g.alt):
+            homozygous_alt[x] = homozygous_alt.get(x, 0) | (1 << j)
+    incompatible = []
+    for g in until_deadline(genotypes, deadline, 256):
+        bits = 0
+        for x in set_bits(g.ref):
+            bits |= homozygous_alt.get(x, 0)
+        for x in set_bits(g.alt):
+            bits |= homozygous_ref.get(x, 0)
+        incompatible.append(bits)
+    return incompatible
+
+# A set (list of indices) of pairwise incompatible genotypes, grown greedily from a seed genotype,
+# trying the genotypes in the given order (incompatible as from incompatible_sets)
+def incompatible_set(incompatible, seed, order):
+    chosen = [seed]
+    candidates = incompatible[seed]     # the genotypes incompatible with every chosen one so far
+    for i in order:
+        if not candidates:
+            break
+        if candidates >> i & 1:
+            chosen.append(i)
+            candidates &= incompatible[i]
+    return chosen
+
+# Lower bound on the parsimony of any phasing of the (distinct, packed) genotypes
+# We grow an incompatible set from each of the first seeds genotypes in order of weight and number
+# of incompatible genotypes, and keep the best bound
+# Apart from building the incompatible sets this is O(n log n + seeds n) bit operations: a forced
+# haplotype can only explain chosen genotypes compatible with the genotype forcing it, which are
+# found with a mask rather than by testing every chosen genotype
+# If the deadline (a time.time() value, if any) passes, we return the best bound so far
+def parsimony_lower_bound(genotypes, seeds=16, deadline=None):
+    n = len(genotypes)
+    if n == 0:
+        return 0
+    forced = forced_haplotypes(genotypes)
+    best = len(forced)
+    try:
+        incompatible = incompatible_sets(genotypes, deadline)
+    except TimeLimitReached:
+        return best
+    counts = [bin(bits).count("1") for bits in incompatible]
+    order = sorted(xrange(n), key=lambda i: (-weight(genotypes[i]), -counts[i], i))
+    for seed in order[:seeds]:
+        if deadline is not None and time.time() >= deadline:
+            break
+        chosen = incompatible_set(incompatible, seed, order)
+        chosen_mask = 0
+        for i in chosen:
+            chosen_mask |= 1 << i
+        # forced haplotypes explaining none of the chosen genotypes
+        extra = 0
+        for bits, source in forced.iteritems():
+            if not any(not bits & genotypes[j].ref and bits & genotypes[j].alt == genotypes[j].alt
+                    for j in set_bits(chosen_mask & ~incompatible[source])):
+                extra += 1
+        best = max(best, sum(weight(genotypes[i]) for i in chosen) + extra)
+    return best
@@ -0,0 +1,131 @@
+"""
+em.py
+
+Module for the expectation-maximization (EM) haplotype frequency phaser (see Phaser.phase_em)
+
+A segment is a run of SNPs [start, end) together with its candidate haplotypes (an H x w array of
+alleles) and the candidate phases of every genotype class over it, as three parallel arrays:
+owner (the class), one and two (indices of the two haplotypes), sorted by owner
+EM estimates the population frequency of each candidate haplotype, alternating between
+    E step: the probability of each candidate phase of a class is f(one) * f(two) (twice that
+            for two different haplotypes), normalized over the class's candidate phases
+    M step: the frequency of a haplotype is its expected count over all 2n haplotypes
+which is a handful of numpy operations per iteration, whatever the number of genotypes
+
+Partition-ligation keeps the candidate sets small: the SNPs are split into blocks which are
+phased on their own (a block of w SNPs has at most 2^w candidate haplotypes), then only the likely
+haplotypes of each block are kept and adjacent segments are ligated, their candidate haplotypes
+being the concatenations of the kept haplotypes on either side, until one segment is left
+
+Author: Ryan Baker
+"""
+
+# numpy is optional; it is only needed for the EM phaser
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Segment class
+class Segment:
+
+    def __init__(self, start, end, haplotypes, owner, one, two):
+        self.start = start
+        self.end = end
+        self.haplotypes = haplotypes    # H x (end - start) int8 array of alleles
+        self.owner = owner              # class of each candidate phase (sorted)
+        self.one = one                  # index of the first haplotype of each candidate phase
+        self.two = two                  # index of the second haplotype of each candidate phase
+        return
+
+# The segment of one block of SNPs [start, end), whose candidate phases are all the phases of each
+# class (packed genotypes over m SNPs) restricted to the block
+# assignments(het, w) gives the assignments of the ambiguous sites of a block (Phaser.ambiguous_assignments)
+def block_segment(classes, start, end, assignments):
+    w = end - start
+    shift = classes[0].m - end
+    mask = (1 << w) - 1
+    owner = []
+    one = []
+    two = []
+    for c in xrange(len(classes)):
+        alt = (classes[c].alt >> shift) & mask
+        het = (classes[c].het >> shift) & mask
+        for assignment in assignments(het, w):
+            owner.append(c)
+            one.append(alt | assignment)
+            two.append(alt | (assignment ^ het))
+    # number the distinct haplotypes (by their bits within the block)
+    bits, inverse = numpy.unique(numpy.array(one + two, dtype=numpy.int64), return_inverse=True)
+    haplotypes = ((bits[:, None] >> numpy.arange(w - 1, -1, -1, dtype=numpy.int64)) & 1).astype(numpy.int8)
+    return Segment(start, end, haplotypes, numpy.array(owner, dtype=numpy.intp),
+            inverse[:len(one)], inverse[len(one):])
+
+# Run EM on a segment, where weights are the multiplicities of the classes
+# Returns (frequencies of the candidate haplotypes, posterior probabilities of the candidate phases)
+def estimate_frequencies(segment, weights, iterations=100, tolerance=1e-6):
+    h = len(segment.haplotypes)
+    classes = len(weights)
+    total = 2.0 * weights.sum()
+    frequencies = numpy.ones(h) / h
+    heterozygous = numpy.where(segment.one != segment.two, 2.0, 1.0)
+    for iteration in xrange(iterations):
+        # E step (floored, so that a class never has all of its phases at probability zero)
+        likelihood = numpy.maximum(frequencies[segment.one] * frequencies[segment.two] * heterozygous, 1e-300)
+        posterior = likelihood / numpy.bincount(segment.owner, likelihood, classes)[segment.owner]
+        # M step
+        expected = posterior * weights[segment.owner]
+        updated = (numpy.bincount(segment.one, expected, h) + numpy.bincount(segment.two, expected, h)) / total
+        change = numpy.abs(updated - frequencies).max()
+        frequencies = updated
+        if change < tolerance:
+            break
+    likelihood = numpy.maximum(frequencies[segment.one] * frequencies[segment.two] * heterozygous, 1e-300)
+    posterior = likelihood / numpy.bincount(segment.owner, likelihood, classes)[segment.owner]
+    return frequencies, posterior
+
+# The index of the most likely candidate phase of each class (ties go to the first one)
+def best_phases(segment, posterior, classes):
+    order = numpy.lexsort((numpy.arange(len(posterior)), -posterior, segment.owner))
+    starts = numpy.searchsorted(segment.owner[order], numpy.arange(classes))
+    return order[starts]
+
+# Keep only the candidate haplotypes with at least min_frequency, and those in the most likely
+# phase of some class (so every class keeps at least one candidate phase)
+def prune(segment, frequencies, best, min_frequency):
+    keep = frequencies >= min_frequency
+    keep[segment.one[best]] = True
+    keep[segment.two[best]] = True
+    renumber = numpy.cumsum(keep) - 1
+    kept = keep[segment.one] & keep[segment.two]
+    return Segment(segment.start, segment.end, segment.haplotypes[keep], segment.owner[kept],
+            renumber[segment.one[kept]], renumber[segment.two[kept]])
+
+# Ligate two adjacent segments: the candidate phases of a class are its candidate phases on the
+# left joined with each of its candidate phases on the right, in both orientations
+def ligate_segments(left, right, classes):
+    # pair every left phase of a class with every right phase of the same class
+    right_counts = numpy.bincount(right.owner, minlength=classes)
+    right_starts = numpy.concatenate(([0], numpy.cumsum(right_counts)[:-1]))
+    repeats = right_counts[left.owner]
+    left_index = numpy.repeat(numpy.arange(len(left.owner)), repeats)
+    block_starts = numpy.concatenate(([0], numpy.cumsum(repeats)[:-1]))
+    within = numpy.arange(len(left_index)) - numpy.repeat(block_starts, repeats)
+    right_index = right_starts[left.owner[left_index]] + within
+    owner = left.owner[left_index]
+    left_one, left_two = left.one[left_index], left.two[left_index]
+    right_one, right_two = right.one[right_index], right.two[right_index]
+    # the swapped orientation is a different phase unless one side is homozygous
+    swapped = (left_one != left_two) & (right_one != right_two)
+    owner = numpy.concatenate((owner, owner[swapped]))
+    one_halves = (numpy.concatenate((left_one, left_one[swapped])), numpy.concatenate((right_one, right_two[swapped])))
+    two_halves = (numpy.concatenate((left_two, left_two[swapped])), numpy.concatenate((right_two, right_one[swapped])))
+    order = numpy.argsort(owner, kind="mergesort")
+    owner = owner[order]
+    # number the distinct concatenated haplotypes by their (left, right) halves
+    width = len(right.haplotypes)
+    keys = numpy.concatenate((one_halves[0][order] * width + one_halves[1][order],
+            two_halves[0][order] * width + two_halves[1][order]))
+    halves, inverse = numpy.unique(keys, return_inverse=True)
+    haplotypes = numpy.hstack((left.haplotypes[halves // width], right.haplotypes[halves % width]))
+    return Segment(left.start, right.end, haplotypes, owner, inverse[:len(owner)], inverse[len(owner):])
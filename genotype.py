@@ -18,13 +18,15 @@ class Genotype:
 
     # e.g. Genotype([0 2 0 1]) explicitly, or
     # can do Genotype(random=True, length=5) to generate a random genotype of length 5
-    def __init__(self, data=None, random=False, length=None):
+    # validate=False skips checking the data, for data which has already been checked in bulk
+    def __init__(self, data=None, random=False, length=None, validate=True):
         if data is not None:
             self.data = data    # the genotype data; list of ints with values 0, 1, 2
             self.m = len(data)  # m is the number of SNPs
-            for x in self.data:
-                if not (x == Genotype.HOMO_REF or x == Genotype.HOMO_ALT or x == Genotype.HETERO):
-                    raise ValueError("bad genotype data")
+            if validate:
+                for x in self.data:
+                    if not (x == Genotype.HOMO_REF or x == Genotype.HOMO_ALT or x == Genotype.HETERO):
+                        raise ValueError("bad genotype data")
         else:
             if length is None:
                 raise ValueError("must provide length for random genotype")
@@ -0,0 +1,60 @@
+"""
+genotypefile.py
+
+Module for reading unphased genotype files and writing phased haplotypes, a chunk at a time
+
+A genotype file has one individual per line, with one genotype per SNP encoded the same way as
+Genotype (0 = homozygous REF, 1 = homozygous ALT, 2 = heterozygous), e.g. "0120" or "0 1 2 0"
+Blank lines and lines starting with # are skipped. Individuals are read in chunks so that a file
+with any number of individuals can be phased without holding all of it in memory
+
+The phased output has two lines per individual, its two haplotypes as strings of 0s and 1s
+(the same as printing a Phase), written as soon as each chunk is phased
+
+Author: Ryan Baker
+"""
+
+from genotype import Genotype
+
+# Parse one line of a genotype file into a Genotype (None for blank lines and comments)
+def parse_genotype(line):
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    try:
+        return Genotype([int(x) for x in line.replace(" ", "").replace("\t", "").replace(",", "")])
+    except ValueError:
+        raise ValueError("bad genotype line: %r" % line[:40])
+
+# Read a genotype file, yielding lists of (at most) chunk_size genotypes
+# If m is given, only the first m SNPs of each genotype are kept
+def read_genotype_chunks(filename, chunk_size, m=None):
+    genofile = open(filename, "r")
+    try:
+        chunk = []
+        snps = None
+        for line in genofile:
+            genotype = parse_genotype(line)
+            if genotype is None:
+                continue
+            if m is not None:
+                if genotype.m < m:
+                    raise ValueError("genotype file has fewer than %d SNPs" % m)
+                genotype = Genotype(genotype.data[:m])
+            if snps is None:
+                snps = genotype.m
+            elif genotype.m != snps:
+                raise ValueError("genotypes in the file have different numbers of SNPs")
+            chunk.append(genotype)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        genofile.close()
+
+# Write a phasing to out (a file object), two haplotype lines per individual
+def write_phasing(out, phasing):
+    out.write("".join("%s\n%s\n" % (phase[0], phase[1]) for phase in phasing))
+    out.flush()
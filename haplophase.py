@@ -7,7 +7,33 @@ Author: Ryan Baker
 """
 
 from phaserunner import PhaseRunner
+from phasecache import PhaseCache
 import argparse
+import cProfile
+import sys
+
+# Progress report of the exhaustive/branch and bound search (see Phaser.scan_phasings)
+def report_progress(elapsed, searched, best_parsimony):
+    sys.stderr.write("%.0fs: %d searched, best parsimony so far %d\n" % (elapsed, searched, best_parsimony))
+
+# The name (see PhaseRunner.algorithms) of the algorithm picked on the command line
+def algorithm_name(args):
+    if args.greedy:
+        return "greedy"
+    elif args.incremental_greedy:
+        return "incremental-greedy"
+    elif args.branch_and_bound:
+        return "branch-and-bound"
+    elif args.ilp:
+        return "ilp"
+    elif args.hash:
+        return "hash"
+    elif args.clark:
+        return "clark"
+    elif args.em:
+        return "em"
+    else:
+        return "exhaustive"
 
 def main():
 
@@ -18,30 +44,118 @@ def main():
                     help="number of SNPs")
     parser.add_argument("-e", "--exhaustive", action="store_true",
                     help="use exhaustive algorithm")
+    parser.add_argument("-b", "--branch-and-bound", action="store_true",
+                    help="use exact branch and bound algorithm")
+    parser.add_argument("-l", "--ilp", action="store_true",
+                    help="use exact integer programming algorithm")
+    parser.add_argument("-t", "--time-limit", type=float,
+                    help="time limit in seconds for the exact algorithms (exhaustive, branch and bound, integer programming), after which the best phasing found so far is returned")
+    parser.add_argument("--bound", action="store_true",
+                    help="print a lower bound on the parsimony, and whether it proves the phasing optimal (any algorithm)")
+    parser.add_argument("--progress", action="store_true",
+                    help="report the progress of the exhaustive/branch and bound search on stderr every second")
     parser.add_argument("-g", "--greedy", action="store_true", 
                     help="use greedy algorithm")
+    parser.add_argument("-i", "--incremental-greedy", action="store_true",
+                    help="use incremental greedy algorithm (same result as greedy, scales to more SNPs)")
+    parser.add_argument("-c", "--clark", action="store_true",
+                    help="use Clark's rule-based inference algorithm (no reference data needed)")
+    parser.add_argument("--em", action="store_true",
+                    help="use expectation-maximization of haplotype frequencies with partition-ligation (requires numpy)")
     parser.add_argument("-x", "--hash", action="store_true",
                     help="use greedy hash lookup algorithm")
+    parser.add_argument("-w", "--window", type=int,
+                    help="phase overlapping windows of this many SNPs with the chosen algorithm and ligate them")
+    parser.add_argument("-d", "--decompose", action="store_true",
+                    help="split the genotypes into groups no haplotype can be shared between (connected components of the compatibility graph) and phase each group on its own with the chosen algorithm")
+    parser.add_argument("--overlap", type=int, default=3,
+                    help="number of SNPs shared by adjacent windows (default 3)")
+    parser.add_argument("--panel",
+                    help="precompiled reference panel file for the hash algorithm (built from the input file if missing or out of date)")
     parser.add_argument("-f", "--file",
                     help="hapmap phased haplotype input data file")
+    parser.add_argument("-G", "--genotypes",
+                    help="unphased genotype file to phase (one individual per line of 0/1/2 = hom REF/hom ALT/het); the haplotypes are written to --output")
+    parser.add_argument("-o", "--output",
+                    help="output file for the haplotypes phased from --genotypes (default stdout)")
+    parser.add_argument("--chunk-size", type=int, default=1000,
+                    help="number of individuals from --genotypes phased (and held in memory) at a time (default 1000)")
     parser.add_argument("-p", type=int,
                     help="number of haplotypes in the haplotype pool (if random haplotype pool should be used as input)")
+    parser.add_argument("--packed", action="store_true",
+                    help="use bit-packed haplotypes/genotypes internally (faster)")
+    parser.add_argument("--numpy", action="store_true",
+                    help="use the numpy (vectorized) backend for the greedy algorithm")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                    help="number of worker processes for windows/components/exhaustive search (default 1)")
+    parser.add_argument("--phase-cache-size", type=int, default=1 << 20,
+                    help="maximum number of enumerated phases kept in the phase cache (default 2^20, 0 to disable)")
+    parser.add_argument("--profile", action="store_true",
+                    help="print the time spent in each stage of the algorithm and counts of its operations")
+    parser.add_argument("--cprofile", metavar="FILE",
+                    help="run under cProfile and dump the stats to FILE (read them with pstats)")
     parser.add_argument("-v", "--verbose", action="store_true",
                     help="print extra output/data")
 
     args = parser.parse_args()
+    if args.decompose and args.window:
+        parser.error("-d/--decompose and -w/--window cannot be combined")
+
+    progress = report_progress if args.progress else None
+    pr = PhaseRunner(args.packed, args.numpy, args.jobs, args.profile, PhaseCache(args.phase_cache_size), args.bound)
+
 
-    pr = PhaseRunner()
+    if args.cprofile:
+        profiler = cProfile.Profile()
+        profiler.enable()
 
+    # phase real genotype data, streaming out the haplotypes
+    # output will be in format (on stderr if the haplotypes go to stdout):
+    # elapsed_time individuals parsimony (summed over the chunks)
+    if args.genotypes:
+        out = open(args.output, "w") if args.output else sys.stdout
+        try:
+            t, n, parsimony = pr.phase_file(algorithm_name(args), args.genotypes, out, args.chunk_size, args.m,
+                    args.window, args.overlap, args.file, args.panel, args.time_limit, args.decompose)
+        finally:
+            if args.output:
+                out.close()
+        if args.cprofile:
+            profiler.disable()
+            profiler.dump_stats(args.cprofile)
+        summary = sys.stderr if out is sys.stdout else sys.stdout
+        summary.write("%g %d %d\n" % (t, n, parsimony))
+        if args.profile:
+            summary.write("%s\n" % pr.phaser.profile)
+            summary.write("phase cache: %s\n" % pr.phaser.phase_cache.stats())
+        return
 
     # run the phasing algorithm!
     # they return: elapsed_time, self.get_accuracy(real_phase_data, phasing), (parsimony, real_parsimony), real_phase_data, phasing
-    if args.greedy:
+    if args.window:
+        t, acc, pars, real_phase_data, phasing = pr.run_windowed(algorithm_name(args), args.window, args.overlap, args.n, args.m, args.file, args.p != None, args.p)
+    elif args.decompose:
+        t, acc, pars, real_phase_data, phasing = pr.run_decomposed(algorithm_name(args), args.n, args.m, args.file, args.p != None, args.p, args.time_limit)
+    elif args.greedy:
         t, acc, pars, real_phase_data, phasing = pr.run_greedy(args.n, args.m, args.file, args.p != None, args.p)
+    elif args.incremental_greedy:
+        t, acc, pars, real_phase_data, phasing = pr.run_greedy_incremental(args.n, args.m, args.file, args.p != None, args.p)
+    elif args.branch_and_bound:
+        t, acc, pars, real_phase_data, phasing = pr.run_branch_and_bound(args.n, args.m, args.file, args.p != None, args.p, args.time_limit, progress)
+    elif args.ilp:
+        t, acc, pars, real_phase_data, phasing = pr.run_ilp(args.n, args.m, args.file, args.p != None, args.p, args.time_limit)
     elif args.hash:
-        t, acc, pars, real_phase_data, phasing = pr.run_hash(args.n, args.m, args.file, args.p != None, args.p)
+        t, acc, pars, real_phase_data, phasing = pr.run_hash(args.n, args.m, args.file, args.p != None, args.p, args.panel)
+    elif args.clark:
+        t, acc, pars, real_phase_data, phasing = pr.run_clark(args.n, args.m, args.file, args.p != None, args.p)
+    elif args.em:
+        t, acc, pars, real_phase_data, phasing = pr.run_em(args.n, args.m, args.file, args.p != None, args.p)
     else: # if args.exhaustive
-        t, acc, pars, real_phase_data, phasing = pr.run_exhaustive(args.n, args.m, args.file, args.p != None, args.p)
+        t, acc, pars, real_phase_data, phasing = pr.run_exhaustive(args.n, args.m, args.file, args.p != None, args.p, args.time_limit, progress)
+
+    if args.cprofile:
+        profiler.disable()
+        profiler.dump_stats(args.cprofile)
 
     if args.verbose:
         for phase in real_phase_data:
@@ -56,5 +170,17 @@ def main():
     # elapsed_time correct_phases/total_phases accuracy found_parsimony/actual_parsimony
     print "%g %d/%d %.5f %d/%d" % (t, acc[0], acc[1], acc[2], pars[0], pars[1])
 
+    # with a time limit, say whether the exact algorithm finished
+    if args.time_limit is not None and pr.optimal is not None:
+        print "optimal" if pr.optimal else "not optimal (time limit reached)"
+
+    # lower_bound found_parsimony, and whether the bound proves the phasing optimal
+    if args.bound:
+        print "lower bound %d %d%s" % (pr.lower_bound, pars[0], " (optimal)" if pars[0] <= pr.lower_bound else "")
+
+    if args.profile:
+        print pr.phaser.profile
+        print "phase cache: %s" % pr.phaser.phase_cache.stats()
+
 if __name__ == '__main__':
     main()
@@ -3,32 +3,146 @@ haplophase_tests.py
 
 Program to run haplotype phasing tests and record results
 
+Every (algorithm, n, m, p, seed) is one configuration. The configurations are spread over a pool of
+worker processes, and each result is appended to the results file (and printed) as soon as it is
+done, so an interrupted sweep keeps everything it finished. Run again with the same results file,
+it skips the configurations already in it and only runs the rest
+Each configuration seeds the random data with its own seed, so its result does not depend on which
+worker ran it or when; the timings are taken while other configurations run on the other workers,
+though, so use -j 1 for timings comparable with a serial run
+
+The results go to haplophase_tests.txt by default (results.txt holds the original results, in the
+older format without seed and p that process_haplophase_tests.py reads, so do not append to it)
+
+e.g. python haplophase_tests.py -j 4
+     python haplophase_tests.py -j 4 -n 25 50 100 -m 4 8 12 16 --seeds 5 -a greedy hash -o sweep.txt
+
 Author: Ryan Baker
 """
 
 from phaserunner import PhaseRunner
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+
+# The algorithms tested by default, with the SNP counts each one is tested on
+GRID = [
+    ("exhaustive", range(2, 4)),
+    ("greedy", range(2, 16, 2)),
+    ("hash", range(2, 16, 2)),
+]
 
 # output will be in format:
-# inputfile n m  algorithm elapsed_time correct_phases total_phases accuracy found_parsimony actual_parsimony
-def out(f, n, m, algo, t, acc, pars, real_phase_data, phasing):
+# inputfile n m  algorithm elapsed_time correct_phases total_phases accuracy found_parsimony actual_parsimony seed p
+def out(f, n, m, algo, t, acc, pars, real_phase_data, phasing, seed, p):
     if not f:
         f = "random"
-    print "%s %d %d %s %g %d %d %.5f %d %d" % (f, n, m, algo, t, acc[0], acc[1], acc[2], pars[0], pars[1])
+    return "%s %d %d %s %g %d %d %.5f %d %d %d %d" % (f, n, m, algo, t, acc[0], acc[1], acc[2], pars[0], pars[1], seed, p)
+
+# Key of a configuration (inputfile, n, m, p, algorithm, seed), as it is recorded in the output
+def configuration_key(config):
+    f, n, m, p, algo, seed = config
+    return ("random" if not f else f, n, m, p, algo, seed)
+
+# The keys of the configurations already in a results file
+# Lines without a seed and p (from before results were keyed by them) and partly written lines are ignored
+def finished_configurations(filename):
+    finished = set()
+    if not os.path.exists(filename):
+        return finished
+    for line in open(filename):
+        data = line.split()
+        if len(data) != 12:
+            continue
+        try:
+            finished.add(configuration_key((data[0], int(data[1]), int(data[2]), int(data[11]), data[3], int(data[10]))))
+        except ValueError:
+            continue
+    return finished
+
+# The PhaseRunner of a worker process (so each worker only reads each hapmap file once)
+runner = None
+
+# Run one configuration (in a worker process): config is (inputfile, n, m, p, algorithm, seed)
+# Returns (config, output line or None, error message or None)
+def run_configuration(config):
+    global runner
+    f, n, m, p, algo, seed = config
+    if runner is None:
+        runner = PhaseRunner()
+    try:
+        random.seed(seed)
+        t, acc, pars, real_phase_data, phasing = runner.run(algo, n, m, f, True, p)
+        return config, out(f, n, m, algo, t, acc, pars, real_phase_data, phasing, seed, p), None
+    except Exception as e:
+        return config, None, "%s: %s" % (type(e).__name__, e)
+
+# All the configurations of the sweep, in the order they are handed out
+def configurations(args):
+    configs = []
+    for algo in (args.algorithms or [algo for algo, snps in GRID]):
+        for n in args.n:
+            for m in (args.m or dict(GRID)[algo]):
+                for seed in xrange(args.seed, args.seed + args.seeds):
+                    configs.append((args.file, n, m, args.p, algo, seed))
+    return configs
 
 def main():
-    pr = PhaseRunner()
-    f = "data2.txt"
-    n = 25
-    p = 4
-    for m in xrange(2, 4):
-        t, acc, pars, real_phase_data, phasing = pr.run_exhaustive(n, m, f, True, p)
-        out(f, n, m, "exhaustive", t, acc, pars, real_phase_data, phasing)
-    for m in xrange(2, 16, 2):
-        t, acc, pars, real_phase_data, phasing = pr.run_greedy(n, m, f, True, p)
-        out(f, n, m, "greedy", t, acc, pars, real_phase_data, phasing)
-    for m in xrange(2, 16, 2):
-        t, acc, pars, real_phase_data, phasing = pr.run_hash(n, m, f, True, p)
-        out(f, n, m, "hash", t, acc, pars, real_phase_data, phasing)
+
+    parser = argparse.ArgumentParser(description="Run the haplotype phasing tests over a grid of configurations")
+    parser.add_argument("-f", "--file", default="data2.txt",
+                    help="hapmap file for the hash reference data (default data2.txt)")
+    parser.add_argument("-n", type=int, nargs="+", default=[25],
+                    help="numbers of individuals to test (default 25)")
+    parser.add_argument("-m", type=int, nargs="+",
+                    help="numbers of SNPs to test (default the grid for each algorithm)")
+    parser.add_argument("-p", type=int, default=4,
+                    help="size of the random haplotype pool (default 4)")
+    parser.add_argument("-a", "--algorithms", nargs="+", choices=sorted(PhaseRunner().algorithms()),
+                    help="algorithms to test (default exhaustive, greedy and hash)")
+    parser.add_argument("--seed", type=int, default=0,
+                    help="first random seed (default 0)")
+    parser.add_argument("--seeds", type=int, default=1,
+                    help="number of seeds (random data sets) per configuration (default 1)")
+    parser.add_argument("-j", "--jobs", type=int, default=multiprocessing.cpu_count(),
+                    help="number of worker processes (default the number of CPUs)")
+    parser.add_argument("-o", "--output", default="haplophase_tests.txt",
+                    help="results file to append to, and to resume from (default haplophase_tests.txt)")
+
+    args = parser.parse_args()
+    if not args.m and any(algo not in dict(GRID) for algo in (args.algorithms or [])):
+        parser.error("-m is needed for algorithms other than %s" % ", ".join(algo for algo, snps in GRID))
+
+    finished = finished_configurations(args.output)
+    pending = [config for config in configurations(args) if configuration_key(config) not in finished]
+    sys.stderr.write("%d configurations to run (%d already finished)\n" % (len(pending), len(finished)))
+    if not pending:
+        return
+
+    results = open(args.output, "a")
+    pool = multiprocessing.Pool(max(1, min(args.jobs, len(pending))))
+    try:
+        done = pool.imap_unordered(run_configuration, pending)
+        for i in xrange(len(pending)):
+            # waiting with a timeout lets Ctrl-C through to us
+            config, line, error = done.next(1 << 30)
+            if error is not None:
+                f, n, m, p, algo, seed = config
+                sys.stderr.write("%s n=%d m=%d %s seed %d: %s\n" % (f, n, m, algo, seed, error))
+                continue
+            print line
+            results.write(line + "\n")
+            results.flush()
+        pool.close()
+    except:
+        # interrupted: whatever finished is already in the results file
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        results.close()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,128 @@
+"""
+haplotrie.py
+
+Module for a prefix trie of reference (packed) haplotypes, for resolving the genotypes the hash
+phaser finds no reference phase for (see Phaser.phase_hash)
+
+The trie branches on the alleles of the SNPs in order, and every node counts the reference
+haplotypes below it. For a genotype we look for the phase (a, b) and the pair of reference
+haplotypes (r, s) minimizing the Hamming distance d(a, r) + d(b, s), walking down the trie with
+both r and s at once: at a homozygous site both should have the genotype's allele, at an ambiguous
+site they should differ (and whichever allele r has is a's). Branches are searched depth first,
+cheapest step first (then most common subtree first), and a branch is dropped as soon as its
+distance is as big as that of the best pair found so far, so assignments of the ambiguous sites
+no pair of reference haplotypes comes close to are never followed to the end. Nodes with only a
+few distinct haplotypes below them also keep those haplotypes, and once both walks are at such
+nodes the rest of the distance of every pair of them is a few popcounts on the packed bits, rather
+than one trie step per SNP. Each pair of trie nodes is reached by one path only, so the search
+is at most O(m R^2) for R distinct reference haplotypes, and in practice visits a few paths out
+of the trie
+
+Author: Ryan Baker
+"""
+
+from packed import snp_bit
+
+# Nodes with at most this many distinct haplotypes below them keep them (see above)
+LEAF_SIZE = 16
+
+# Number of 1 bits in an integer
+def popcount(bits):
+    return bin(bits).count("1")
+
+# HaplotypeTrie class
+class HaplotypeTrie:
+
+    # A node is a list [child with allele 0, child with allele 1, number of haplotypes below it,
+    # dict mapping the bits of the distinct haplotypes below it to their counts (None if there are
+    # more than LEAF_SIZE of them)]
+    def __init__(self, m):
+        self.m = m
+        self.root = [None, None, 0, {}]
+        return
+
+    # Build the trie of the haplotypes of reference phase counts (mapping PackedPhase to its count)
+    @staticmethod
+    def from_phase_counts(m, phase_counts):
+        trie = HaplotypeTrie(m)
+        for phase, count in phase_counts.iteritems():
+            trie.add(phase[0].bits, count)
+            trie.add(phase[1].bits, count)
+        return trie
+
+    # Add a haplotype (by its bits) count times
+    def add(self, bits, count=1):
+        node = self.root
+        for x in xrange(self.m + 1):
+            node[2] += count
+            if node[3] is not None:
+                node[3][bits] = node[3].get(bits, 0) + count
+                if len(node[3]) > LEAF_SIZE:
+                    node[3] = None
+            if x == self.m:
+                break
+            allele = 1 if bits & snp_bit(x, self.m) else 0
+            if node[allele] is None:
+                node[allele] = [None, None, 0, {}]
+            node = node[allele]
+
+    def __len__(self):
+        return self.root[2]
+
+    # The phase of a packed genotype closest to a pair of reference haplotypes (see above)
+    # Returns (bits, distance), where the phase is (bits, bits ^ het) and bits has REF at the first
+    # ambiguous site (like Phaser.generate_valid_haplotype_phases); for an empty trie, the phase
+    # with REF at every ambiguous site and distance None
+    def nearest_phase(self, genotype):
+        m = self.m
+        if self.root[2] == 0:
+            return genotype.alt, None
+        best_bits = genotype.alt
+        best_distance = 2 * m + 1
+        best_weight = 0
+        stack = [(0, self.root, self.root, 0, 0)]  # depth, node for r, node for s, distance, alleles of a at ambiguous sites
+        while stack:
+            depth, one, two, distance, chosen = stack.pop()
+            if distance >= best_distance:
+                continue
+            if one[3] is not None and two[3] is not None:
+                # finish every pair of the haplotypes below on the remaining sites at once
+                rest = (1 << (m - depth)) - 1
+                het = genotype.het & rest
+                hom = rest & ~genotype.het
+                for r, r_count in one[3].iteritems():
+                    r_distance = distance + popcount((r ^ genotype.alt) & hom)
+                    for s, s_count in two[3].iteritems():
+                        if one is two and s < r:
+                            continue
+                        pair_distance = r_distance + popcount((s ^ genotype.alt) & hom) + popcount(~(r ^ s) & het)
+                        weight = r_count * s_count
+                        if pair_distance < best_distance or (pair_distance == best_distance and weight > best_weight):
+                            best_bits, best_distance, best_weight = genotype.alt | chosen | (r & het), pair_distance, weight
+                if best_distance == 0:
+                    break
+                continue
+            bit = snp_bit(depth, m)
+            het = genotype.het & bit
+            allele = 1 if genotype.alt & bit else 0
+            steps = []
+            for a in (0, 1):
+                if one[a] is None:
+                    continue
+                for b in (0, 1):
+                    # (r, s) and (s, r) are the same pair while both are at the same node
+                    if two[b] is None or (one is two and a > b):
+                        continue
+                    if het:
+                        cost = 1 if a == b else 0
+                    else:
+                        cost = (a != allele) + (b != allele)
+                    if distance + cost < best_distance:
+                        steps.append((cost, -one[a][2] * two[b][2], one[a], two[b], chosen | bit if het and a else chosen))
+            # the cheapest step is searched first, so it goes on the stack last
+            steps.sort(key=lambda step: step[:2], reverse=True)
+            for cost, weight, child_one, child_two, child_chosen in steps:
+                stack.append((depth + 1, child_one, child_two, distance + cost, child_chosen))
+        if genotype.het and best_bits & (1 << (genotype.het.bit_length() - 1)):
+            best_bits ^= genotype.het
+        return best_bits, best_distance
@@ -15,12 +15,14 @@ class Haplotype:
     REF = 0
     ALT = 1
 
-    def __init__(self, data):
+    # validate=False skips checking the data, for data which has already been checked in bulk
+    def __init__(self, data, validate=True):
         self.data = data    # the genotype data; list of ints with values 0, 1, 2
         self.m = len(data)  # m is number of SNPs
-        for x in self.data:
-            if not (x == Haplotype.REF or x == Haplotype.ALT):
-                raise ValueError("bad haplotype data")
+        if validate:
+            for x in self.data:
+                if not (x == Haplotype.REF or x == Haplotype.ALT):
+                    raise ValueError("bad haplotype data")
         return
 
     # Generate a complementary haplotype for a given genotype
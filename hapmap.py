@@ -0,0 +1,70 @@
+"""
+hapmap.py
+
+Module for loading phased haplotype data from HapMap files
+
+The file is memory-mapped and read in a single pass, with each SNP (line) encoded straight
+into a compact row of 0s and 1s, one per haplotype column (0 is whichever allele the first
+haplotype column has at that SNP). Lines are only parsed as far as they are needed, and
+any subset of SNPs and individuals can then be taken without reading the file again
+
+Author: Ryan Baker
+"""
+
+import mmap
+from haplotype import Haplotype
+from phase import Phase
+
+# HapMap class
+class HapMap:
+
+    def __init__(self, filename):
+        hapfile = open(filename, "rb")
+        try:
+            self.map = mmap.mmap(hapfile.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            hapfile.close()
+        # throw away the first two columns of the header; the rest name the haplotype columns
+        self.columns = self.map.readline().split()[2:]
+        self.individuals = len(self.columns) // 2
+        self.rows = []      # one bytearray of 0s and 1s per SNP parsed so far
+        self.done = False   # whether we have reached the end of the file
+        return
+
+    # Parse lines until we have m SNPs (or until the end of the file if m is None)
+    def load(self, m=None):
+        while not self.done and (m is None or len(self.rows) < m):
+            line = self.map.readline()
+            if not line:
+                self.done = True
+                self.map.close()
+                break
+            alleles = line.split()[2:]
+            if not alleles:
+                continue
+            ref_snp = alleles[0]
+            self.rows.append(bytearray([0 if a == ref_snp else 1 for a in alleles]))
+        if m is not None and len(self.rows) < m:
+            raise ValueError("hapmap file has fewer than %d SNPs" % m)
+
+    # Number of SNPs in the file (this parses the whole file)
+    def snp_count(self):
+        self.load()
+        return len(self.rows)
+
+    # The haplotype in column c (individual c // 2) over the given SNP indices
+    def haplotype(self, c, snps):
+        rows = self.rows
+        return Haplotype([rows[s][c] for s in snps])
+
+    # The phases of the given individuals (all of them by default) over the given SNPs
+    # (the first m SNPs can be given as xrange(m); all SNPs by default)
+    def phases(self, individuals=None, snps=None):
+        if snps is None:
+            self.load()
+            snps = xrange(len(self.rows))
+        elif snps:
+            self.load(max(snps) + 1)
+        if individuals is None:
+            individuals = xrange(self.individuals)
+        return [Phase(self.haplotype(2 * i, snps), self.haplotype(2 * i + 1, snps)) for i in individuals]
@@ -0,0 +1,176 @@
+"""
+ilp.py
+
+Module for solving minimum parsimony phasing as an integer program
+(haplotype inference by pure parsimony)
+
+For each genotype g and each valid phase p = (a, b) of g there is a 0/1 variable y[g,p],
+and for each candidate haplotype h there is a 0/1 variable x[h]:
+    minimize    sum of x[h]
+    subject to  sum over p of y[g,p] = 1     for every genotype g
+                y[g,p] <= x[a], y[g,p] <= x[b] for every phase p = (a, b) of g
+
+The program is solved by our own branch and bound over the same variables (see
+ParsimonyModel.solve_branch_and_bound); there is no external MILP solver, since none runs on the
+Python 2 this code targets
+
+Author: Ryan Baker
+"""
+
+from bounds import BoundReached
+from timelimit import TimeLimitReached, until_deadline
+import time
+
+# ParsimonyModel class
+class ParsimonyModel:
+
+    # genotypes is a list of PackedGenotype objects
+    # Candidate haplotypes are those in the explaining sets of the genotypes; dominated phases are
+    # pruned before the model is built (see prune_dominated)
+    # Enumerating the explaining sets is exponential in the ambiguous sites, so with a deadline
+    # (a time.time() value) building the model raises TimeLimitReached once it has passed
+    def __init__(self, genotypes, deadline=None):
+        self.genotypes = genotypes
+        self.n = len(genotypes)
+        self.m = genotypes[0].m
+        # count how many genotypes each candidate haplotype explains
+        self.explain_count = {}
+        for g in genotypes:
+            for bits in until_deadline(g.explaining_bits(), deadline):
+                self.explain_count[bits] = self.explain_count.get(bits, 0) + 1
+        # the valid phases of each genotype, as pairs of haplotype bits
+        # (each phase once, with the first ambiguous site REF in the first haplotype)
+        phase_bits = []
+        for g in genotypes:
+            top_het = 1 << (g.het.bit_length() - 1) if g.het else 0
+            phase_bits.append([(bits, bits ^ g.het) for bits in until_deadline(g.explaining_bits(), deadline)
+                    if not bits & top_het])
+        phase_bits = [self.prune_dominated(phases) for phases in phase_bits]
+        # index the candidate haplotypes which are still used by some phase
+        self.haplotypes = sorted(set(bits for phases in phase_bits for phase in phases for bits in phase))
+        index = dict((bits, h) for h, bits in enumerate(self.haplotypes))
+        self.phases = [[(index[a], index[b]) for a, b in phases] for phases in phase_bits]
+        return
+
+    # A phase both of whose haplotypes explain no other genotype always costs two new haplotypes,
+    # so all such phases of a genotype are interchangeable and we only need to keep one of them
+    def prune_dominated(self, phases):
+        kept = []
+        have_private = False
+        for a, b in phases:
+            if self.explain_count[a] == 1 and self.explain_count[b] == 1:
+                if have_private:
+                    continue
+                have_private = True
+            kept.append((a, b))
+        return kept
+
+    # Number of distinct haplotypes used by a solution (a chosen phase index per genotype)
+    def objective(self, choice):
+        used = set()
+        for g in xrange(self.n):
+            used.update(self.phases[g][choice[g]])
+        return len(used)
+
+    # The phase bits (hap_one bits, hap_two bits) chosen for genotype g by a solution
+    def phase_bits(self, choice, g):
+        a, b = self.phases[g][choice[g]]
+        return self.haplotypes[a], self.haplotypes[b]
+
+    # Find the solution index of a phase (given as a pair of haplotype bits) of genotype g
+    # If the phase was pruned as dominated, the private phase which was kept in its place is used
+    def choice_of(self, g, hap_one, hap_two):
+        private = None
+        for p, (a, b) in enumerate(self.phases[g]):
+            pair = (self.haplotypes[a], self.haplotypes[b])
+            if pair == (hap_one, hap_two) or pair == (hap_two, hap_one):
+                return p
+            if self.explain_count[pair[0]] == 1 and self.explain_count[pair[1]] == 1:
+                private = p
+        if private is None:
+            raise ValueError("phase does not match genotype")
+        return private
+
+    # Solve with a pure Python branch and bound, starting from an incumbent solution
+    # Genotypes with the fewest phases are assigned first; a branch is pruned once the haplotypes
+    # it already uses are as many as the incumbent's, and the search stops once the incumbent
+    # matches a known lower bound on the parsimony (see bounds.py)
+    # Returns (choice, parsimony, lower_bound); if the time limit runs out the lower bound is the
+    # smallest bound over the branches we did not get to
+    def solve_branch_and_bound(self, incumbent, time_limit=None, lower_bound=0):
+        deadline = None if time_limit is None else time.time() + time_limit
+        order = sorted(xrange(self.n), key=lambda g: len(self.phases[g]))
+        best = [list(incumbent), self.objective(incumbent)]
+        current = [None] * self.n
+        pool = {}   # maps haplotype index to the number of chosen phases using it
+        open_bounds = []
+        def new_haplotypes(pair):
+            if pair[0] == pair[1]:
+                return 0 if pair[0] in pool else 1
+            return (pair[0] not in pool) + (pair[1] not in pool)
+        def add(pair):
+            for h in set(pair):
+                pool[h] = pool.get(h, 0) + 1
+        def remove(pair):
+            for h in set(pair):
+                pool[h] -= 1
+                if pool[h] == 0:
+                    del pool[h]
+        # the search is iterative (a genotype per level would overflow Python's recursion limit):
+        # each frame is [depth, the phase indices of its genotype sorted when it is first visited,
+        # next of them to try]
+        stack = [[0, None, 0]]
+        def search():
+            while stack:
+                frame = stack[-1]
+                depth = frame[0]
+                if depth == self.n:
+                    if len(pool) < best[1]:
+                        best[0] = list(current)
+                        best[1] = len(pool)
+                        if best[1] <= lower_bound:
+                            raise BoundReached()
+                    stack.pop()
+                    continue
+                g = order[depth]
+                if frame[1] is None:
+                    frame[1] = sorted(xrange(len(self.phases[g])), key=lambda p: new_haplotypes(self.phases[g][p]))
+                else:
+                    # back from the subtree of the phase tried last
+                    remove(self.phases[g][frame[1][frame[2] - 1]])
+                    current[g] = None
+                options = frame[1]
+                if frame[2] < len(options):
+                    p = options[frame[2]]
+                    pair = self.phases[g][p]
+                    if len(pool) + new_haplotypes(pair) < best[1]:
+                        if deadline is not None and time.time() > deadline:
+                            # remember the best bound of what is left at this level, then unwind
+                            open_bounds.append(len(pool) + new_haplotypes(pair))
+                            stack.pop()
+                            unwind()
+                            raise TimeLimitReached()
+                        add(pair)
+                        current[g] = p
+                        frame[2] += 1
+                        stack.append([depth + 1, None, 0])
+                        continue
+                stack.pop()
+        # the later phases at each level above were not explored either
+        def unwind():
+            while stack:
+                depth, options, i = stack.pop()
+                g = order[depth]
+                remove(self.phases[g][options[i - 1]])
+                current[g] = None
+                if i < len(options):
+                    open_bounds.append(len(pool) + new_haplotypes(self.phases[g][options[i]]))
+        try:
+            if best[1] > lower_bound:
+                search()
+            lower_bound = best[1]
+        except BoundReached:
+            lower_bound = best[1]
+        except TimeLimitReached:
+            lower_bound = min(open_bounds + [best[1]])
+        return best[0], best[1], lower_bound
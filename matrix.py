@@ -0,0 +1,150 @@
+"""
+matrix.py
+
+Module for dense (numpy array backed) genotype and haplotype data for a whole cohort
+
+A GenotypeMatrix holds n genotypes as one n x m array, and a HaplotypeMatrix holds n phases as
+one n x 2 x m array, so converting phases to genotypes, checking accuracy against the true
+phases and counting parsimony are each a few array operations instead of loops over thousands
+of Genotype/Haplotype objects. The data is validated once, in bulk, when a matrix is built
+(or not at all when it is trusted, i.e. it came from another matrix), and rows are views into
+the array, so nothing is copied until plain objects are asked for
+
+Author: Ryan Baker
+"""
+
+from genotype import Genotype
+from haplotype import Haplotype
+from phase import Phase
+
+# numpy is optional; it is only needed for the matrices
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def require_numpy():
+    if numpy is None:
+        raise ValueError("genotype/haplotype matrices require numpy")
+
+# GenotypeMatrix class
+class GenotypeMatrix:
+
+    # data is an n x m array (or nested lists) of genotype values (0, 1, 2)
+    # trusted=True skips the validation, for data we know to be good
+    def __init__(self, data, trusted=False):
+        require_numpy()
+        self.data = numpy.asarray(data, dtype=numpy.int8)
+        if self.data.ndim != 2:
+            raise ValueError("genotype matrix must be n x m")
+        self.n, self.m = self.data.shape
+        if not trusted and not ((self.data >= Genotype.HOMO_REF) & (self.data <= Genotype.HETERO)).all():
+            raise ValueError("bad genotype data")
+        return
+
+    @staticmethod
+    def from_genotypes(genotypes):
+        return GenotypeMatrix([g.data for g in genotypes])
+
+    # The genotype of individual i as a row of the array (a view, not a copy)
+    def row(self, i):
+        return self.data[i]
+
+    # The genotype of individual i as a Genotype
+    def genotype(self, i):
+        return Genotype(self.data[i].tolist(), validate=False)
+
+    # All of the genotypes as a list of Genotype objects (without checking them again)
+    def to_genotypes(self):
+        return [Genotype(row, validate=False) for row in self.data.tolist()]
+
+    def __getitem__(self, i):
+        return self.genotype(i)
+
+    def __len__(self):
+        return self.n
+
+# HaplotypeMatrix class
+class HaplotypeMatrix:
+
+    # data is an n x 2 x m array (or nested lists) of alleles (0, 1): the two haplotypes of each individual
+    # trusted=True skips the validation, for data we know to be good
+    def __init__(self, data, trusted=False):
+        require_numpy()
+        self.data = numpy.asarray(data, dtype=numpy.int8)
+        if self.data.ndim != 3 or self.data.shape[1] != 2:
+            raise ValueError("haplotype matrix must be n x 2 x m")
+        self.n, two, self.m = self.data.shape
+        if not trusted and not ((self.data == Haplotype.REF) | (self.data == Haplotype.ALT)).all():
+            raise ValueError("bad haplotype data")
+        return
+
+    @staticmethod
+    def from_phases(phases):
+        return HaplotypeMatrix([[phase[0].data, phase[1].data] for phase in phases])
+
+    # The phases of individuals (all of them by default) over the given SNPs (all of them by default)
+    # in a HapMap, straight from its rows of 0s and 1s
+    @staticmethod
+    def from_hapmap(hapmap, individuals=None, snps=None):
+        if snps is None:
+            hapmap.load()
+            snps = xrange(len(hapmap.rows))
+        elif snps:
+            hapmap.load(max(snps) + 1)
+        if individuals is None:
+            individuals = xrange(hapmap.individuals)
+        # rows is m x (2 * individuals in the file), one column per haplotype
+        rows = numpy.array([numpy.frombuffer(bytes(hapmap.rows[s]), dtype=numpy.int8) for s in snps], dtype=numpy.int8)
+        columns = numpy.array([[2 * i, 2 * i + 1] for i in individuals], dtype=numpy.intp).reshape(-1, 2)
+        return HaplotypeMatrix(rows.reshape(len(snps), -1)[:, columns].transpose(1, 2, 0), trusted=True)
+
+    # All 2n haplotypes as a 2n x m array (a view; rows 2i and 2i + 1 are individual i's)
+    def haplotypes(self):
+        return self.data.reshape(2 * self.n, self.m)
+
+    # The phase of individual i as a 2 x m array (a view, not a copy)
+    def row(self, i):
+        return self.data[i]
+
+    # The phase of individual i as a Phase
+    def phase(self, i):
+        hap_one, hap_two = self.data[i].tolist()
+        return Phase(Haplotype(hap_one, validate=False), Haplotype(hap_two, validate=False))
+
+    # All of the phases as a list of Phase objects (without checking them again)
+    def to_phases(self):
+        return [Phase(Haplotype(hap_one, validate=False), Haplotype(hap_two, validate=False))
+                for hap_one, hap_two in self.data.tolist()]
+
+    # The genotypes induced by the phases
+    # Homozygous sites keep the allele (REF = HOMO_REF = 0, ALT = HOMO_ALT = 1), the rest are HETERO
+    def to_genotypes(self):
+        hap_one = self.data[:, 0]
+        hap_two = self.data[:, 1]
+        return GenotypeMatrix(numpy.where(hap_one == hap_two, hap_one, Genotype.HETERO), trusted=True)
+
+    # Compare with the true phases, ignoring the order of the two haplotypes of each individual
+    # Returns (correct phases, total phases, accuracy) like PhaseRunner.get_accuracy
+    def accuracy(self, truth):
+        if (self.n, self.m) != (truth.n, truth.m):
+            raise ValueError("haplotype matrices have different shapes")
+        one, two = self.data[:, 0], self.data[:, 1]
+        true_one, true_two = truth.data[:, 0], truth.data[:, 1]
+        straight = ((one == true_one) & (two == true_two)).all(axis=1)
+        swapped = ((one == true_two) & (two == true_one)).all(axis=1)
+        correct_phases = int((straight | swapped).sum())
+        return correct_phases, self.n, float(correct_phases) / float(self.n)
+
+    # Number of distinct haplotypes, counting the unique rows once they are packed into bytes
+    def parsimony(self):
+        if self.n == 0:
+            return 0
+        packed = numpy.packbits(self.haplotypes().astype(numpy.uint8), axis=1)
+        return len(numpy.unique(packed, axis=0))
+
+    def __getitem__(self, i):
+        return self.phase(i)
+
+    def __len__(self):
+        return self.n
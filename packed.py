@@ -0,0 +1,260 @@
+"""
+packed.py
+
+Module for bit-packed haplotype, genotype and phase data
+
+Each haplotype is stored as a single integer bitmask, and each genotype as three
+bitmasks (homozygous ref, homozygous alt, heterozygous sites). This turns the
+per-SNP loops in explains/complement/matches into a handful of bitwise operations.
+
+SNP x of an m SNP sequence lives at bit (m - 1 - x), so that counting from 0 to 2^m - 1
+visits haplotypes in the same order as product([0, 1], repeat=m).
+
+Author: Ryan Baker
+"""
+
+from genotype import Genotype
+from haplotype import Haplotype
+from phase import Phase
+
+# Returns the bit used for SNP x in a sequence of m SNPs
+def snp_bit(x, m):
+    return 1 << (m - 1 - x)
+
+# Packs a list of 0s and 1s into an integer (first element is the most significant bit)
+def pack_bits(data):
+    bits = 0
+    for x in data:
+        bits = (bits << 1) | x
+    return bits
+
+# Packed genotype class
+class PackedGenotype:
+
+    HOMO_REF = Genotype.HOMO_REF
+    HOMO_ALT = Genotype.HOMO_ALT
+    HETERO   = Genotype.HETERO
+
+    # ref, alt and het are bitmasks of the homozygous ref, homozygous alt and heterozygous sites
+    def __init__(self, ref, alt, het, m):
+        self.ref = ref
+        self.alt = alt
+        self.het = het
+        self.m = m
+        if (ref | alt | het) >> m or ref & alt or ref & het or alt & het:
+            raise ValueError("bad genotype data")
+        self.hash = hash((alt, het, m))
+        return
+
+    # Build a packed genotype from a Genotype object
+    # O(m), but only done once per genotype
+    @staticmethod
+    def from_genotype(genotype):
+        ref = alt = het = 0
+        for x in genotype.data:
+            ref <<= 1
+            alt <<= 1
+            het <<= 1
+            if x == Genotype.HOMO_REF:
+                ref |= 1
+            elif x == Genotype.HOMO_ALT:
+                alt |= 1
+            else: # HETERO
+                het |= 1
+        return PackedGenotype(ref, alt, het, genotype.m)
+
+    def to_genotype(self):
+        return Genotype(self.data)
+
+    # Generate the bits of every haplotype which explains this genotype
+    # (the alt bits plus each subset of the heterozygous bits), so 2^k of them for k ambiguous sites
+    def explaining_bits(self):
+        subset = self.het
+        while True:
+            yield self.alt | subset
+            if subset == 0:
+                return
+            subset = (subset - 1) & self.het
+
+    # The genotype as a list of 0s, 1s, and 2s (same layout as Genotype.data)
+    @property
+    def data(self):
+        return [self[x] for x in xrange(self.m)]
+
+    def __hash__(self):
+        return self.hash
+
+    def __eq__(self, other):
+        if isinstance(other, PackedGenotype):
+            return (self.m == other.m and self.alt == other.alt and self.het == other.het)
+        else:
+            return False
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __getitem__(self, x):
+        bit = snp_bit(x, self.m)
+        if self.het & bit:
+            return Genotype.HETERO
+        elif self.alt & bit:
+            return Genotype.HOMO_ALT
+        else:
+            return Genotype.HOMO_REF
+
+    def __len__(self):
+        return self.m
+
+    def __repr__(self):
+        return repr(self.data)
+
+    def __str__(self):
+        s = ""
+        for x in self.data:
+            s += str(x)
+        return s
+
+# Packed haplotype class
+class PackedHaplotype:
+
+    REF = Haplotype.REF
+    ALT = Haplotype.ALT
+
+    # bits is an integer whose bit (m - 1 - x) holds the allele at SNP x
+    def __init__(self, bits, m):
+        self.bits = bits
+        self.m = m
+        if bits < 0 or bits >> m:
+            raise ValueError("bad haplotype data")
+        self.hash = hash((bits, m))
+        return
+
+    @staticmethod
+    def from_haplotype(haplotype):
+        return PackedHaplotype(pack_bits(haplotype.data), haplotype.m)
+
+    def to_haplotype(self):
+        return Haplotype(self.data)
+
+    @property
+    def data(self):
+        bits = self.bits
+        return [(bits >> x) & 1 for x in xrange(self.m - 1, -1, -1)]
+
+    # Generate a complementary haplotype for a given packed genotype
+    # Flipping the heterozygous bits is all it takes, so this is O(1) word operations
+    def complement(self, genotype):
+        if self.m != genotype.m:
+            raise ValueError("genotype/haplotype length mismatch")
+        if not self.explains(genotype):
+            raise ValueError("non-complementable haplotype for given genotype")
+        return PackedHaplotype(self.bits ^ genotype.het, self.m)
+
+    # Determines whether a haplotype explains a given packed genotype:
+    # no ALT allele at a homozygous ref site and no REF allele at a homozygous alt site
+    def explains(self, genotype):
+        if self.m != genotype.m:
+            raise ValueError("genotype/haplotype length mismatch")
+        return not (self.bits & genotype.ref) and (self.bits & genotype.alt) == genotype.alt
+
+    def __hash__(self):
+        return self.hash
+
+    def __eq__(self, other):
+        if isinstance(other, PackedHaplotype):
+            return (self.bits == other.bits and self.m == other.m)
+        else:
+            return False
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __getitem__(self, x):
+        return (self.bits >> (self.m - 1 - x)) & 1
+
+    def __len__(self):
+        return self.m
+
+    def __repr__(self):
+        return repr(self.data)
+
+    def __str__(self):
+        s = ""
+        for x in self.data:
+            s += str(x)
+        return s
+
+# Packed phase class
+class PackedPhase:
+
+    def __init__(self, hap_one, hap_two):
+        self.haps = [hap_one, hap_two]  # haps is a list of two packed haplotypes
+        self.m = hap_one.m              # m is the number of SNPs
+        if hap_one.m != hap_two.m:
+            raise ValueError("phase data has mismatched haplotypes")
+        return
+
+    @staticmethod
+    def from_phase(phase):
+        return PackedPhase(PackedHaplotype.from_haplotype(phase[0]), PackedHaplotype.from_haplotype(phase[1]))
+
+    def to_phase(self):
+        return Phase(self.haps[0].to_haplotype(), self.haps[1].to_haplotype())
+
+    # Returns true/false based on whether this phase is congruent with a given packed genotype
+    def matches(self, genotype):
+        a = self.haps[0].bits
+        b = self.haps[1].bits
+        return (not ((a | b) & genotype.ref)
+            and (a & b & genotype.alt) == genotype.alt
+            and ((a ^ b) & genotype.het) == genotype.het)
+
+    # Returns a packed genotype representation of this pair of haplotypes
+    def to_genotype(self):
+        a = self.haps[0].bits
+        b = self.haps[1].bits
+        full = (1 << self.m) - 1
+        return PackedGenotype(~(a | b) & full, a & b, a ^ b, self.m)
+
+    # Override equality so that the order of the haplotypes does not matter
+    def __eq__(self, other):
+        if isinstance(other, PackedPhase):
+            return ((self.haps[0] == other.haps[0] and self.haps[1] == other.haps[1])
+                or (self.haps[0] == other.haps[1] and self.haps[1] == other.haps[0]))
+        else:
+            return False
+
+    def __hash__(self):
+        return self.haps[0].hash + self.haps[1].hash
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __getitem__(self, i):
+        return self.haps[i]
+
+    def __len__(self):
+        return self.m
+
+    def __repr__(self):
+        return repr(self.haps)
+
+    def __str__(self):
+        s = ""
+        for c in xrange(len(self.haps)):
+            s += str(self.haps[c])
+            if (c < len(self.haps) - 1):
+                s += '\n'
+        return s
+
+# Convert a list of Genotype objects to packed genotypes (already packed ones are kept as is)
+def pack_genotypes(genotypes):
+    return [g if isinstance(g, PackedGenotype) else PackedGenotype.from_genotype(g) for g in genotypes]
+
+# Convert a list of Phase objects to packed phases (already packed ones are kept as is)
+def pack_phasing(phasing):
+    return [p if isinstance(p, PackedPhase) else PackedPhase.from_phase(p) for p in phasing]
+
+# Convert a packed phasing back to a list of Phase objects
+def unpack_phasing(phasing):
+    return [p.to_phase() if isinstance(p, PackedPhase) else p for p in phasing]
@@ -0,0 +1,154 @@
+"""
+panel.py
+
+Module for precompiled reference panels for the hash phaser
+
+A reference panel holds the distinct reference phases (as packed haplotypes) over the first
+m SNPs of a HapMap file, along with how many times each one occurs, which is exactly the
+phase count hash table Phaser.phase_hash would otherwise build on every run
+Panels are saved in a small binary format and loaded through mmap; they remember a content
+hash of the file they were built from, so a panel built from a different file is never used
+
+File layout (all integers little-endian):
+    header: magic "HAPPANEL", format version (uint32), SHA-1 of the source file (20 bytes),
+            m (uint32), number of distinct phases (uint32), bytes per haplotype (uint32)
+    then one record per distinct phase: hap_one bits, hap_two bits (big-endian, bytes per
+            haplotype each), count (uint32)
+
+Author: Ryan Baker
+"""
+
+import binascii
+import hashlib
+import mmap
+import os
+import struct
+from packed import PackedHaplotype, PackedPhase, pack_phasing
+from haplotrie import HaplotypeTrie
+
+MAGIC = "HAPPANEL"
+VERSION = 1
+HEADER = struct.Struct("<8sI20sIII")
+COUNT = struct.Struct("<I")
+
+# SHA-1 digest of the contents of a file
+def file_digest(filename):
+    digest = hashlib.sha1()
+    f = open(filename, "rb")
+    try:
+        for block in iter(lambda: f.read(1 << 20), ""):
+            digest.update(block)
+    finally:
+        f.close()
+    return digest.digest()
+
+# Index phase counts by the genotype each phase induces
+# Maps PackedGenotype to (count, bits) for its most common reference phase, where bits is the
+# haplotype of that phase which has REF at the first ambiguous site (so the phase is
+# (bits, bits ^ het), which is how Phaser.generate_valid_haplotype_phases would produce it)
+# Ties go to the lowest bits, which is the phase the enumeration in Phaser.phase_hash would find first
+def genotype_index(phase_counts):
+    index = {}
+    for phase, count in phase_counts.iteritems():
+        genotype = phase.to_genotype()
+        bits = phase[0].bits
+        if genotype.het and bits & (1 << (genotype.het.bit_length() - 1)):
+            bits ^= genotype.het
+        if genotype in index:
+            best_count, best_bits = index[genotype]
+            if count < best_count or (count == best_count and bits > best_bits):
+                continue
+        index[genotype] = (count, bits)
+    return index
+
+# ReferencePanel class
+class ReferencePanel:
+
+    # phase_counts maps PackedPhase to its count in the reference data
+    # digest is the content hash of the source file (None if the panel has no source file)
+    def __init__(self, m, phase_counts, digest=None):
+        self.m = m
+        self.phase_counts = phase_counts
+        self.digest = digest
+        self.index = None
+        self.trie = None
+        return
+
+    # The genotype index of this panel's phases (see genotype_index), built the first time it is needed
+    def genotype_index(self):
+        if self.index is None:
+            self.index = genotype_index(self.phase_counts)
+        return self.index
+
+    # The trie of this panel's haplotypes (see haplotrie.py), built the first time it is needed
+    def haplotype_trie(self):
+        if self.trie is None:
+            self.trie = HaplotypeTrie.from_phase_counts(self.m, self.phase_counts)
+        return self.trie
+
+    # Build a panel from a list of reference phases (plain or packed)
+    @staticmethod
+    def from_phases(phases, digest=None):
+        phase_counts = {}
+        for phase in pack_phasing(phases):
+            if phase in phase_counts:
+                phase_counts[phase] += 1
+            else:
+                phase_counts[phase] = 1
+        return ReferencePanel(phases[0].m, phase_counts, digest)
+
+    def save(self, path):
+        width = (self.m + 7) // 8
+        out = open(path, "wb")
+        try:
+            out.write(HEADER.pack(MAGIC, VERSION, self.digest or "\0" * 20, self.m, len(self.phase_counts), width))
+            for phase, count in self.phase_counts.iteritems():
+                for hap in phase:
+                    out.write(binascii.unhexlify("%0*x" % (2 * width, hap.bits)))
+                out.write(COUNT.pack(count))
+        finally:
+            out.close()
+
+    # Load a saved panel
+    # Returns None if there is no usable panel at path: it is missing, is not a panel, or was built
+    # for a different m or from a different source file (if digest/m are given)
+    @staticmethod
+    def load(path, digest=None, m=None):
+        if not os.path.exists(path) or os.path.getsize(path) < HEADER.size:
+            return None
+        panelfile = open(path, "rb")
+        try:
+            data = mmap.mmap(panelfile.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            panelfile.close()
+        try:
+            magic, version, panel_digest, panel_m, count, width = HEADER.unpack_from(data, 0)
+            if magic != MAGIC or version != VERSION:
+                return None
+            if (digest is not None and panel_digest != digest) or (m is not None and panel_m != m):
+                return None
+            if len(data) != HEADER.size + count * (2 * width + COUNT.size):
+                return None
+            phase_counts = {}
+            offset = HEADER.size
+            for i in xrange(count):
+                hap_one = PackedHaplotype(int(binascii.hexlify(data[offset:offset + width]) or "0", 16), panel_m)
+                offset += width
+                hap_two = PackedHaplotype(int(binascii.hexlify(data[offset:offset + width]) or "0", 16), panel_m)
+                offset += width
+                phase_counts[PackedPhase(hap_one, hap_two)] = COUNT.unpack_from(data, offset)[0]
+                offset += COUNT.size
+            return ReferencePanel(panel_m, phase_counts, panel_digest)
+        finally:
+            data.close()
+
+    # Load the panel at path if it was built from the current contents of filename (over m SNPs);
+    # otherwise build it with build_phases() (which returns the reference phases) and save it to path
+    @staticmethod
+    def load_or_build(path, filename, m, build_phases):
+        digest = file_digest(filename)
+        panel = ReferencePanel.load(path, digest, m)
+        if panel is None:
+            panel = ReferencePanel.from_phases(build_phases(), digest)
+            panel.save(path)
+        return panel
@@ -0,0 +1,71 @@
+"""
+phasecache.py
+
+Module for a size-bounded LRU cache of phase enumerations
+
+The ways to phase a genotype only depend on where its heterozygous sites are: the homozygous
+sites are the same in every phase. So Phaser enumerates the phases of a heterozygosity pattern
+once, as the bits of the ambiguous sites which are ALT on the first haplotype, caches them under
+(m, het bits), and fills in the homozygous sites for each genotype it is asked about
+The cache holds at most max_phases enumerated phases in total (about 40 bytes each, more for
+m > 60), evicting the least recently used patterns first
+
+Author: Ryan Baker
+"""
+
+from collections import OrderedDict
+
+# PhaseCache class
+class PhaseCache:
+
+    def __init__(self, max_phases=1 << 20):
+        self.max_phases = max_phases
+        self.entries = OrderedDict()    # maps key to its list of phases, least recently used first
+        self.size = 0                   # total number of phases in the cache
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        return
+
+    # The cached value of key, or None (which counts as a miss)
+    def get(self, key):
+        value = self.entries.pop(key, None)
+        if value is None:
+            self.misses += 1
+            return None
+        # reinsert to mark it as the most recently used
+        self.entries[key] = value
+        self.hits += 1
+        return value
+
+    # Cache a list of phases under key, evicting old entries to stay within max_phases
+    # (lists longer than max_phases are not cached at all)
+    def put(self, key, value):
+        if len(value) > self.max_phases or key in self.entries:
+            return
+        while self.size + len(value) > self.max_phases:
+            old_key, old_value = self.entries.popitem(last=False)
+            self.size -= len(old_value)
+            self.evictions += 1
+        self.entries[key] = value
+        self.size += len(value)
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    # Hit/miss statistics as a dictionary
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": float(self.hits) / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "patterns": len(self.entries),
+            "phases": self.size,
+            "max_phases": self.max_phases,
+        }
+
+    def __len__(self):
+        return len(self.entries)
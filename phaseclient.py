@@ -0,0 +1,128 @@
+"""
+phaseclient.py
+
+Thin client for the phasing server (see phaseserver.py)
+
+Takes the same algorithm flags as haplophase.py's genotype file mode, sends the genotype file to
+the server in batches of --chunk-size individuals and writes out the phased haplotypes the same way
+
+e.g. python phaseclient.py --socket /tmp/haplophase.sock -x -f hapmap.txt -G genotypes.txt -o haplotypes.txt
+
+Author: Ryan Baker
+"""
+
+from genotypefile import read_genotype_chunks
+from haplophase import algorithm_name
+import argparse
+import json
+import socket
+import sys
+
+# PhaseClient class: one connection to the server, over which any number of batches can be phased
+class PhaseClient:
+
+    # Connect to the server on a Unix socket path, or else on a localhost TCP port
+    def __init__(self, socket_path=None, port=8124):
+        if socket_path is not None:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(socket_path)
+        else:
+            self.socket = socket.create_connection(("127.0.0.1", port))
+        self.rfile = self.socket.makefile("rb")
+        self.wfile = self.socket.makefile("wb")
+        return
+
+    # Phase a batch of genotypes (Genotype objects or strings of 0/1/2)
+    # options are the optional request fields (reference, panel, window, overlap, time_limit, decompose)
+    # Returns (phasing, parsimony, time on the server), the phasing as pairs of haplotype strings
+    def phase(self, genotypes, algorithm="exhaustive", **options):
+        request = dict((key, value) for key, value in options.iteritems() if value is not None)
+        request["algorithm"] = algorithm
+        request["genotypes"] = [str(g) for g in genotypes]
+        self.wfile.write(json.dumps(request) + "\n")
+        self.wfile.flush()
+        line = self.rfile.readline()
+        if not line:
+            raise IOError("the phasing server closed the connection")
+        response = json.loads(line)
+        if "error" in response:
+            raise ValueError("phasing server: %s" % response["error"])
+        return response["phasing"], response["parsimony"], response["time"]
+
+    def close(self):
+        self.rfile.close()
+        self.wfile.close()
+        self.socket.close()
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Phase a genotype file on the phasing server")
+    parser.add_argument("--socket",
+                    help="Unix socket path of the server")
+    parser.add_argument("--port", type=int, default=8124,
+                    help="localhost TCP port of the server if no socket is given (default 8124)")
+    parser.add_argument("-m", type=int,
+                    help="number of SNPs (default all of them)")
+    parser.add_argument("-e", "--exhaustive", action="store_true",
+                    help="use exhaustive algorithm")
+    parser.add_argument("-b", "--branch-and-bound", action="store_true",
+                    help="use exact branch and bound algorithm")
+    parser.add_argument("-l", "--ilp", action="store_true",
+                    help="use exact integer programming algorithm")
+    parser.add_argument("-t", "--time-limit", type=float,
+                    help="time limit in seconds for the exact algorithms (exhaustive, branch and bound, integer programming)")
+    parser.add_argument("-g", "--greedy", action="store_true",
+                    help="use greedy algorithm")
+    parser.add_argument("-i", "--incremental-greedy", action="store_true",
+                    help="use incremental greedy algorithm (same result as greedy, scales to more SNPs)")
+    parser.add_argument("-c", "--clark", action="store_true",
+                    help="use Clark's rule-based inference algorithm (no reference data needed)")
+    parser.add_argument("--em", action="store_true",
+                    help="use expectation-maximization of haplotype frequencies with partition-ligation (requires numpy)")
+    parser.add_argument("-x", "--hash", action="store_true",
+                    help="use greedy hash lookup algorithm")
+    parser.add_argument("-w", "--window", type=int,
+                    help="phase overlapping windows of this many SNPs with the chosen algorithm and ligate them")
+    parser.add_argument("-d", "--decompose", action="store_true",
+                    help="phase each group of genotypes no haplotype can be shared between on its own")
+    parser.add_argument("--overlap", type=int, default=3,
+                    help="number of SNPs shared by adjacent windows (default 3)")
+    parser.add_argument("--panel",
+                    help="precompiled reference panel file for the hash algorithm (on the server's file system)")
+    parser.add_argument("-f", "--file",
+                    help="hapmap file of reference phases for the hash algorithm (on the server's file system)")
+    parser.add_argument("-G", "--genotypes", required=True,
+                    help="unphased genotype file to phase (one individual per line of 0/1/2 = hom REF/hom ALT/het)")
+    parser.add_argument("-o", "--output",
+                    help="output file for the phased haplotypes (default stdout)")
+    parser.add_argument("--chunk-size", type=int, default=1000,
+                    help="number of individuals sent to the server at a time (default 1000)")
+
+    args = parser.parse_args()
+
+    client = PhaseClient(args.socket, args.port)
+    out = open(args.output, "w") if args.output else sys.stdout
+    n = 0
+    total_parsimony = 0
+    total_time = 0.0
+    try:
+        for genotypes in read_genotype_chunks(args.genotypes, args.chunk_size, args.m):
+            phasing, parsimony, t = client.phase(genotypes, algorithm_name(args), reference=args.file,
+                    panel=args.panel, window=args.window, overlap=args.overlap, time_limit=args.time_limit,
+                    decompose=args.decompose)
+            out.write("".join("%s\n%s\n" % (hap_one, hap_two) for hap_one, hap_two in phasing))
+            out.flush()
+            n += len(genotypes)
+            total_parsimony += parsimony
+            total_time += t
+    finally:
+        client.close()
+        if args.output:
+            out.close()
+
+    # same summary as haplophase.py -G: elapsed_time (on the server) individuals parsimony
+    summary = sys.stderr if out is sys.stdout else sys.stdout
+    summary.write("%g %d %d\n" % (total_time, n, total_parsimony))
+
+if __name__ == '__main__':
+    main()
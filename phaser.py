@@ -11,18 +11,120 @@ Author: Ryan Baker
 # TODO: Change greedy algorithm to only generate valid combinations?
 
 import copy
+import heapq
+import multiprocessing
+import time
 from itertools import product, combinations_with_replacement
 from genotype import Genotype
 from haplotype import Haplotype
 from sets import Set
 from phase import Phase
+from packed import PackedGenotype, PackedHaplotype, PackedPhase, pack_genotypes, pack_phasing, unpack_phasing, snp_bit
+from ilp import ParsimonyModel
+from timelimit import TimeLimitReached, until_deadline
+from windows import window_bounds, slice_genotype, slice_phase, ligate
+from panel import ReferencePanel
+from haplotrie import HaplotypeTrie
+from profiling import Profile, NullProfile
+from phasecache import PhaseCache
+from matrix import HaplotypeMatrix
+from pool import HaplotypePool
+from em import block_segment, estimate_frequencies, best_phases, prune, ligate_segments
+from bounds import BoundReached, compatible, parsimony_lower_bound
+
+# numpy is optional; it is only needed for the vectorized backend
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # Phaser class
 class Phaser:
 
-    def __init__(self):
+    # If packed is set, the phasing algorithms work on bit-packed haplotypes/genotypes internally
+    # (see packed.py); inputs and outputs are still plain Genotype/Phase objects
+    # If vectorized is set, phase_greedy uses the numpy backend (phase_greedy_vectorized)
+    # jobs is the number of worker processes used for independent work units
+    # (windows in phase_windowed, components in phase_decomposed, slices of the candidates in phase_trivial_improved)
+    # If profile is set, self.profile records the time spent in each stage of the algorithms and
+    # counts of their operations (see profiling.py); call self.profile.reset() between runs
+    # (work done in worker processes is not recorded)
+    # phase_cache is the PhaseCache in which the phase enumerations of heterozygosity patterns are kept
+    # (a new one holding up to 2^20 phases by default; Phasers can share one)
+    def __init__(self, packed=False, vectorized=False, jobs=1, profile=False, phase_cache=None):
+        if vectorized and numpy is None:
+            raise ValueError("the vectorized backend requires numpy")
+        self.packed = packed
+        self.vectorized = vectorized
+        self.jobs = jobs
+        self.profile = Profile() if profile else NullProfile()
+        self.phase_cache = PhaseCache() if phase_cache is None else phase_cache
         return
 
+    # Apply a (module level) function to a list of work units, in a pool of self.jobs processes
+    # Results always come back in the order of the work units, so merging them is deterministic
+    def map(self, function, units):
+        if self.in_process(len(units)):
+            return map(function, units)
+        pool = multiprocessing.Pool(min(self.jobs, len(units)))
+        try:
+            return pool.map(function, units)
+        finally:
+            pool.close()
+            pool.join()
+
+    # Whether map runs a number of work units in this process rather than in a pool
+    def in_process(self, count):
+        return self.jobs <= 1 or count <= 1
+
+    # The phase cache to send with a number of work units: our own if they run in this process,
+    # otherwise just its size, and each worker process keeps a cache of that size (see unit_phaser)
+    def unit_phase_cache(self, count):
+        if self.in_process(count):
+            return self.phase_cache
+        return self.phase_cache.max_phases
+
+    # Convert input genotypes to the representation this phaser works with
+    def pack(self, genotypes):
+        if self.packed:
+            return pack_genotypes(genotypes)
+        return genotypes
+
+    # Convert a phasing back to plain Phase objects
+    def unpack(self, phasing):
+        if self.packed:
+            return unpack_phasing(phasing)
+        return phasing
+
+    # Collapse duplicate genotypes into classes
+    # Returns (classes, multiplicities, class_of): the distinct genotypes in order of first appearance,
+    # how many times each one appears, and the index of the class of each genotype
+    # Identical genotypes can always share a phase in a minimum parsimony phasing, so the exact
+    # algorithms only need to phase the classes, and the greedy ones count each class by its multiplicity
+    def collapse(self, genotypes):
+        classes = []
+        multiplicities = []
+        class_of = []
+        index = {}  # maps genotype to its class index
+        for g in genotypes:
+            if g not in index:
+                index[g] = len(classes)
+                classes.append(g)
+                multiplicities.append(0)
+            multiplicities[index[g]] += 1
+            class_of.append(index[g])
+        return classes, multiplicities, class_of
+
+    # Expand a phasing of the classes (see collapse) back to a phasing of the original genotypes
+    def expand(self, class_phasing, class_of):
+        return [class_phasing[c] for c in class_of]
+
+    # Make a phase out of two haplotypes, in the representation this phaser works with
+    def new_phase(self, hap_one, hap_two):
+        if self.packed:
+            return PackedPhase(hap_one, hap_two)
+        return Phase(hap_one, hap_two)
+
     # Generate all possible haplotypes of length m (SNPs)
     # Returns a list of haplotypes (length 2^m)
     def generate_haplotypes(self, m):
@@ -31,18 +133,23 @@ class Phaser:
             haplotypes.append(Haplotype(h))
         return haplotypes
 
+    # Same as above, but as packed haplotypes (in the same order)
+    def generate_packed_haplotypes(self, m):
+        return [PackedHaplotype(bits, m) for bits in xrange(2 ** m)]
+
     # Generate all possible combinations of two haplotypes of length m (SNPs)
     # Returns a list of length 1 + 2 + ... + 2^m, which is O( 2^(2m) )
     # Each element in the list is a Phase object (with two haplotypes)
     def generate_haplotype_combinations(self, m):
         combinations = []
-        for c in combinations_with_replacement(self.generate_haplotypes(m), 2):
-            combinations.append(Phase(c[0], c[1]))
+        haplotypes = self.generate_packed_haplotypes(m) if self.packed else self.generate_haplotypes(m)
+        for c in combinations_with_replacement(haplotypes, 2):
+            combinations.append(self.new_phase(c[0], c[1]))
         return combinations
 
     # Generates all possible phases which are valid for one specific genotype
     # This is O(2^(k-1)) where k is the number of ambiguous sites (genotype value 2)
-    # Here, we only generate permutations for the ambiguous sites,
+    # Here, we only generate permutations for the ambiguous sites (see ambiguous_assignments),
     # then "insert" each of these permutations
     # Pseudocode:
     #   generate all possible length k-1 binary strings
@@ -51,41 +158,64 @@ class Phaser:
     #       apply the possible binary string it to hap_one
     #       hap_two = complement(hap_one)
     #       add Phase(hap_one, hap_two) to our list
-    def generate_valid_haplotype_phases(self, genotype):
+    # With a deadline (a time.time() value) this raises TimeLimitReached once it has passed
+    def generate_valid_haplotype_phases(self, genotype, deadline=None):
+        if isinstance(genotype, PackedGenotype):
+            return self.generate_valid_packed_phases(genotype, deadline)
+        m = len(genotype)
         ambiguous_sites = [i for i, x in enumerate(genotype) if x == genotype.HETERO]
-        k = len(ambiguous_sites)
+        het = 0
+        for i in ambiguous_sites:
+            het |= snp_bit(i, m)
         # Make a reference list where only the ambiguous sites are unfilled
-        ref_hap = [None] * len(genotype)
-        for i in xrange(len(genotype)):
+        ref_hap = [None] * m
+        for i in xrange(m):
             if genotype[i] == Genotype.HOMO_REF:
                 ref_hap[i] = Haplotype.REF
             elif genotype[i] == Genotype.HOMO_ALT:
                 ref_hap[i] = Haplotype.ALT
         phases = []
-        # If no ambiguous sites, return the only possibility
-        if k == 0:
-            hap_one = Haplotype(list(ref_hap))
-            hap_two = hap_one.complement(genotype)
-            phases.append(Phase(hap_one, hap_two))
-            return phases
-        # Arbitrarily assign to the first unambiguous site
-        ref_hap[ambiguous_sites[0]] = Haplotype.REF
-        # If only one ambiguous site, return the only possibility
-        if k == 1:
-            hap_one = Haplotype(list(ref_hap))
-            hap_two = hap_one.complement(genotype)
-            phases.append(Phase(hap_one, hap_two))
-            return phases
-        # Case where there are several ambiguous sites...
-        for assignment in product([0, 1], repeat=k-1):
-            for i in xrange(1,k):
-                site = ambiguous_sites[i]
-                ref_hap[site] = assignment[i-1]
+        for assignment in until_deadline(self.ambiguous_assignments(het, m, deadline), deadline):
+            for site in ambiguous_sites:
+                ref_hap[site] = Haplotype.ALT if assignment & snp_bit(site, m) else Haplotype.REF
             hap_one = Haplotype(list(ref_hap))
             hap_two = hap_one.complement(genotype)
             phases.append(Phase(hap_one, hap_two))
         return phases
 
+    # Packed version of the above, producing the phases in the same order
+    # hap_one is the homozygous alt bits plus one of the assignments of the ambiguous sites,
+    # and the complement is just hap_one ^ het
+    def generate_valid_packed_phases(self, genotype, deadline=None):
+        m = genotype.m
+        alt = genotype.alt
+        het = genotype.het
+        return [PackedPhase(PackedHaplotype(alt | assignment, m), PackedHaplotype(alt | (assignment ^ het), m))
+                for assignment in until_deadline(self.ambiguous_assignments(het, m, deadline), deadline)]
+
+    # The ways to assign alleles to the ambiguous sites (the bits set in het) of a genotype
+    # on m SNPs in the first haplotype of a phase, as the bits of the sites which are ALT
+    # The first ambiguous site is always REF (swapping the haplotypes gives the same phase), and
+    # the assignments of the other k-1 sites count up in binary, the first site being the most significant
+    # These only depend on het and m, so they are enumerated once and kept in self.phase_cache
+    # (an enumeration cut short by the deadline, see until_deadline, is not kept)
+    def ambiguous_assignments(self, het, m, deadline=None):
+        key = (m, het)
+        assignments = self.phase_cache.get(key)
+        if assignments is None:
+            free_bits = [snp_bit(x, m) for x in xrange(m) if het & snp_bit(x, m)][1:]
+            k = len(free_bits)
+            assignments = []
+            for assignment in until_deadline(xrange(2 ** k), deadline):
+                bits = 0
+                for i in xrange(k):
+                    if assignment & (1 << (k - 1 - i)):
+                        bits |= free_bits[i]
+                assignments.append(bits)
+            self.phase_cache.put(key, assignments)
+            self.profile.count("phases enumerated", len(assignments))
+        return assignments
+
     # Generate all possible valid combinations of phases
     def generate_valid_phasings(self, genotypes):
         phases = [ self.generate_valid_haplotype_phases(g) for g in genotypes ]
@@ -93,6 +223,25 @@ class Phaser:
         # e.g. phases[0] is a list of the possible ways to phase genotype[0]
         return list(product(*phases))
 
+    # Lazily generate all possible valid combinations of phases, one phasing (tuple) at a time
+    # Only the per-genotype phase lists are kept in memory, not the O(2^(n(k-1))) phasings
+    # The candidates can be split into parts disjoint streams (e.g. one per worker) by
+    # dealing out the phases of the genotype with the most of them; part is which one to generate
+    # If preferred (a set of haplotypes) is given, each genotype's phases are tried in order of how
+    # many of their haplotypes are not preferred, so phasings made of those haplotypes come first
+    # Building the phase lists raises TimeLimitReached once the deadline (if any) has passed
+    def iter_valid_phasings(self, genotypes, part=0, parts=1, preferred=None, deadline=None):
+        phases = [ self.generate_valid_haplotype_phases(g, deadline) for g in genotypes ]
+        if preferred is not None:
+            for i in xrange(len(phases)):
+                if deadline is not None and time.time() >= deadline:
+                    raise TimeLimitReached()
+                phases[i] = sorted(phases[i], key=lambda phase: (phase[0] not in preferred) + (phase[1] not in preferred))
+        if parts > 1:
+            split = max(xrange(len(phases)), key=lambda i: len(phases[i]))
+            phases[split] = phases[split][part::parts]
+        return product(*phases)
+
     # Generate all possible combinations of phases
     # Each combination will have n Phase objects, each of which is m SNPs long
     # Returns a list of length O( (2^(2m))^n ) = O( 2^(2mn) )... woah.
@@ -102,6 +251,10 @@ class Phaser:
             phases.append(p)
         return phases
 
+    # Lazily generate all possible combinations of phases (see above), one phasing at a time
+    def iter_phasings(self, n, m):
+        return product(self.generate_haplotype_combinations(m), repeat=n)
+
     # Takes a collection of phasings of n genotypes and removes those which are invalid
     # This is O(n * 2^(2mn))
     def prune_phasings(self, phasings, genotypes):
@@ -119,9 +272,77 @@ class Phaser:
         for bad_phasing in phasings_to_remove:
             phasings.remove(bad_phasing)
 
+    # Lazily filter a stream of phasings of n genotypes, yielding only the valid ones
+    # Unlike prune_phasings this never stores the phasings, and is O(n) per phasing
+    def iter_pruned_phasings(self, phasings, genotypes):
+        n = len(genotypes)
+        for phasing in phasings:
+            if len(phasing) != n:
+                raise ValueError("number of phases must match number of genotypes")
+            if all(phasing[i].matches(genotypes[i]) for i in xrange(n)):
+                yield phasing
+
+    # Find the phasing with minimum parsimony in a stream of phasings
+    # Only the best phasing so far is kept, so memory does not depend on the number of candidates
+    # Ties go to the earliest phasing; returns (None, None) for an empty stream
+    def min_parsimony_phasing(self, phasings):
+        return self.scan_phasings(phasings)[:2]
+
+    # Same, starting from an incumbent phasing (which wins ties) and stopping at a deadline
+    # (a time.time() value) if given; progress, if given, is called about once a second with
+    # (elapsed seconds, phasings scored, best parsimony so far)
+    # With a lower_bound on the parsimony (see lower_bound) we also stop as soon as the best phasing
+    # matches it, since no later phasing can do better (and ties go to the earlier one anyway)
+    # Returns (best phasing, its parsimony, whether it is the best of the whole stream)
+    def scan_phasings(self, phasings, best_phasing=None, best_parsimony=None, deadline=None, progress=None,
+            lower_bound=None):
+        scored = 0
+        complete = True
+        start_time = time.time()
+        next_report = start_time + 1
+        if best_parsimony is not None and lower_bound is not None and best_parsimony <= lower_bound:
+            phasings = []
+        with self.profile.stage("scoring phasings"):
+            for phasing in phasings:
+                parsimony = self.parsimony(phasing)
+                scored += 1
+                if best_parsimony is None or parsimony < best_parsimony:
+                    best_phasing = phasing
+                    best_parsimony = parsimony
+                    if lower_bound is not None and best_parsimony <= lower_bound:
+                        break
+                # only look at the clock every so often
+                if scored & 255 == 0 and (deadline is not None or progress is not None):
+                    now = time.time()
+                    if progress is not None and now >= next_report:
+                        progress(now - start_time, scored, best_parsimony)
+                        next_report = now + 1
+                    if deadline is not None and now >= deadline:
+                        complete = False
+                        break
+        self.profile.count("phasings scored", scored)
+        return best_phasing, best_parsimony, complete
+
+    # Lower bound on the parsimony of any phasing of the genotypes (see bounds.py)
+    # A phasing whose parsimony matches it is optimal
+    # With a deadline (a time.time() value) it is cut short, and weaker, once the deadline passes
+    def lower_bound(self, genotypes, deadline=None):
+        classes = self.collapse(pack_genotypes(genotypes))[0]
+        with self.profile.stage("lower bound"):
+            return parsimony_lower_bound(classes, deadline=deadline)
+
+    # The phasing of (packed) genotypes with REF at every ambiguous site of the first haplotype,
+    # as packed phases; it takes no search at all, so it is what the exact algorithms fall back on
+    # when their time limit runs out before they have anything better
+    def default_phasing(self, genotypes):
+        return [PackedPhase(PackedHaplotype(g.alt, g.m), PackedHaplotype(g.alt | g.het, g.m)) for g in genotypes]
+
     # Computes the parsimony of a phasing
     # Input is a list of n Phase objects, representing a phasing of n genotypes
     def parsimony(self, phasing):
+        # a HaplotypeMatrix counts its unique rows itself
+        if isinstance(phasing, HaplotypeMatrix):
+            return phasing.parsimony()
         # make a set of haplotypes in this phasing
         haplotype_pool = set()
         for phase in phasing:
@@ -135,23 +356,220 @@ class Phaser:
     #   1. Generate all possible phasings of n genotypes, regardless of the genotype information
     #   2. Prune this list, removing phasings that are incongruous with the genotype information
     #   3. At this point, we have all "valid" phasings... check which one has minimum parsimony
+    # All three steps are streamed, so only one candidate phasing is in memory at a time
     # Note that this algorithm is O( 2^(2mn) ). No bueno... but it is guaranteed to be optimal
+    # (we only phase the distinct genotypes, see collapse)
     def phase_trivial(self, genotypes):
-        n = len(genotypes)
-        m = genotypes[0].m
-        phasings = self.generate_phasings(n, m)
-        self.prune_phasings(phasings, genotypes)
-        parsimonies = [ self.parsimony(phasing) for phasing in phasings ]
-        min_parsimony = min(parsimonies)
-        return phasings[parsimonies.index(min_parsimony)], min_parsimony
+        classes, multiplicities, class_of = self.collapse(self.pack(genotypes))
+        n = len(classes)
+        m = classes[0].m
+        phasings = self.iter_pruned_phasings(self.iter_phasings(n, m), classes)
+        best_phasing, min_parsimony = self.min_parsimony_phasing(phasings)
+        return self.unpack(self.expand(best_phasing, class_of)), min_parsimony
 
     # Same as above, but we only generate the 2^(k-1) phasings for k ambiguous (heterozygous) sites
     # This is considerably faster!
-    def phase_trivial_improved(self, genotypes):
-        phasings = self.generate_valid_phasings(genotypes)
-        parsimonies = [ self.parsimony(phasing) for phasing in phasings ]
-        min_parsimony = min(parsimonies)
-        return phasings[parsimonies.index(min_parsimony)], min_parsimony
+    # With several jobs, each worker scans one part of the candidates (see iter_valid_phasings) and
+    # we keep the best of their results (ties go to the first part)
+    # With a time_limit (in seconds) this is an anytime search: we start from the greedy phasing,
+    # try the phasings made of its haplotypes first, and when time runs out return the best phasing
+    # found so far; progress is passed on to scan_phasings (in every worker, with several jobs)
+    # The time limit covers generating the phases and the greedy phasing too
+    # The scan stops early once a phasing matches the lower bound (see lower_bound)
+    # Returns (phasing, parsimony, optimal), where optimal is false if time ran out
+    def phase_trivial_improved(self, genotypes, time_limit=None, progress=None):
+        deadline = None if time_limit is None else time.time() + time_limit
+        classes, multiplicities, class_of = self.collapse(self.pack(genotypes))
+        best_phasing = best_parsimony = preferred = None
+        lower_bound = self.lower_bound(classes, deadline)
+        try:
+            if time_limit is not None:
+                # the time limit counts from the call, so until the greedy phasing is done the
+                # default phasing is the best so far
+                best_phasing = self.default_phasing(pack_genotypes(classes))
+                best_parsimony = self.parsimony(best_phasing)
+                if not self.packed:
+                    best_phasing = unpack_phasing(best_phasing)
+                with self.profile.stage("greedy incumbent"):
+                    best_phasing, best_parsimony = self.phase_greedy_incremental(classes, deadline)
+                if self.packed:
+                    best_phasing = pack_phasing(best_phasing)
+                preferred = set(h for phase in best_phasing for h in phase)
+            if best_parsimony is not None and best_parsimony <= lower_bound:
+                # the greedy phasing is already optimal
+                optimal = True
+            elif self.jobs > 1:
+                # the workers get whatever is left of the time limit
+                remaining = None if deadline is None else max(0, deadline - time.time())
+                phase_cache = self.unit_phase_cache(self.jobs)
+                units = [(self.packed, phase_cache, classes, part, self.jobs, preferred, remaining, progress, lower_bound)
+                        for part in xrange(self.jobs)]
+                optimal = True
+                for phasing, parsimony, complete in self.map(phase_candidates_part, units):
+                    optimal = optimal and complete
+                    if phasing is not None and (best_parsimony is None or parsimony < best_parsimony):
+                        best_phasing, best_parsimony = phasing, parsimony
+                optimal = optimal or best_parsimony <= lower_bound
+            elif time_limit is not None:
+                best_phasing, best_parsimony, optimal = self.scan_phasings(
+                        self.iter_valid_phasings(classes, preferred=preferred, deadline=deadline),
+                        best_phasing, best_parsimony, deadline, progress, lower_bound)
+            else:
+                best_phasing, best_parsimony, optimal = self.scan_phasings(self.iter_valid_phasings(classes),
+                        lower_bound=lower_bound)
+        except TimeLimitReached:
+            # time ran out before the search got going
+            optimal = best_parsimony <= lower_bound
+        return self.unpack(self.expand(best_phasing, class_of)), best_parsimony, optimal
+
+    # Exact minimum parsimony by branch and bound (optimal, like the above, but without ever
+    # building the product of all phasings)
+    # Pseudocode:
+    #   start with the greedy phasing as the best phasing found so far
+    #   sort the genotypes so that those with the fewest valid phases come first
+    #   assign a phase to one genotype at a time, keeping a count of each haplotype in the pool
+    #       try the phases adding the fewest new haplotypes to the pool first
+    #       abandon a branch as soon as its pool is as big as the best parsimony found so far
+    #       stop as soon as the best parsimony matches the lower bound (see lower_bound)
+    # Still exponential in the worst case, but memory is only the per-genotype phase lists
+    # plus the current assignment (and we only assign the distinct genotypes, see collapse)
+    # With a time_limit (in seconds) we return the best phasing found when time runs out (which
+    # counts from the call, so it covers the greedy phasing and generating the phases as well);
+    # progress, if given, is called about once a second with (elapsed seconds, nodes searched,
+    # best parsimony)
+    # Returns (phasing, parsimony, optimal), where optimal is false if time ran out
+    def phase_branch_and_bound(self, genotypes, time_limit=None, progress=None):
+        start_time = time.time()
+        deadline = None if time_limit is None else start_time + time_limit
+        classes, multiplicities, class_of = self.collapse(self.pack(genotypes))
+        n = len(classes)
+        lower_bound = self.lower_bound(classes, deadline)
+        best = [None, None]     # best phasing so far and its parsimony
+        if deadline is not None:
+            # the time limit counts from the call, so until the greedy phasing is done the default
+            # phasing is the best so far
+            best[0] = self.default_phasing(pack_genotypes(classes))
+            best[1] = self.parsimony(best[0])
+        current = [None] * n
+        pool = {}   # maps haplotype to the number of times it is used in current
+        # number of haplotypes of a phase which are not in the pool yet
+        def new_haplotypes(phase):
+            if phase[0] == phase[1]:
+                return 0 if phase[0] in pool else 1
+            return (phase[0] not in pool) + (phase[1] not in pool)
+        def add(phase):
+            for h in phase:
+                pool[h] = pool.get(h, 0) + 1
+        def remove(phase):
+            for h in phase:
+                pool[h] -= 1
+                if pool[h] == 0:
+                    del pool[h]
+        # the search is iterative (a genotype per level would overflow Python's recursion limit):
+        # each frame is [depth, the phases of its genotype sorted when it is first visited, next phase to try]
+        stack = [[0, None, 0]]
+        nodes = [0]     # nodes searched
+        def search():
+            next_report = start_time + 1
+            while stack:
+                frame = stack[-1]
+                depth = frame[0]
+                if frame[1] is None:
+                    nodes[0] += 1
+                    # only look at the clock every so often
+                    if nodes[0] & 255 == 0 and (deadline is not None or progress is not None):
+                        now = time.time()
+                        if progress is not None and now >= next_report:
+                            progress(now - start_time, nodes[0], best[1])
+                            next_report = now + 1
+                        if deadline is not None and now >= deadline:
+                            raise TimeLimitReached()
+                    if depth == n:
+                        if len(pool) < best[1]:
+                            best[0] = list(current)
+                            best[1] = len(pool)
+                            if best[1] <= lower_bound:
+                                raise BoundReached()
+                        stack.pop()
+                        continue
+                    frame[1] = sorted(candidates[order[depth]], key=new_haplotypes)
+                else:
+                    # back from the subtree of the phase tried last
+                    remove(frame[1][frame[2] - 1])
+                i = order[depth]
+                phases = frame[1]
+                # phases are sorted, so once one is pruned every later phase would be pruned as well
+                if frame[2] < len(phases) and len(pool) + new_haplotypes(phases[frame[2]]) < best[1]:
+                    phase = phases[frame[2]]
+                    frame[2] += 1
+                    add(phase)
+                    current[i] = phase
+                    stack.append([depth + 1, None, 0])
+                else:
+                    current[i] = None
+                    stack.pop()
+        optimal = True
+        try:
+            with self.profile.stage("greedy incumbent"):
+                best[0], best[1] = self.phase_greedy_incremental(classes, deadline)
+            candidates = [ self.generate_valid_haplotype_phases(g, deadline) for g in classes ]
+            order = sorted(xrange(n), key=lambda i: len(candidates[i]))
+            with self.profile.stage("search"):
+                # the greedy phasing may already be optimal
+                if best[1] > lower_bound:
+                    search()
+        except BoundReached:
+            pass
+        except TimeLimitReached:
+            optimal = best[1] <= lower_bound
+        self.profile.count("search nodes", nodes[0])
+        # the best phasing may be packed even if we are not (see default_phasing)
+        return unpack_phasing(self.expand(best[0], class_of)), best[1], optimal
+
+    # Exact minimum parsimony as an integer program (see ilp.py)
+    # The candidate haplotypes are the explaining sets of the genotypes, with dominated phases pruned,
+    # and the greedy phasing is the starting incumbent
+    # The program is solved by the pure Python branch and bound in ilp.py
+    # With a time_limit (in seconds) we return the best phasing found so far; the limit counts from
+    # the call, so if it runs out before the greedy phasing is done that is the default phasing
+    # We do not solve at all if the greedy phasing matches the lower bound (see lower_bound), which
+    # otherwise also tightens the solver's bound
+    # Returns (phasing, parsimony, gap), where gap = (parsimony - lower bound) / parsimony,
+    # so a gap of 0 means the phasing is optimal
+    # The program only has variables for the distinct genotypes (see collapse)
+    def phase_ilp(self, genotypes, time_limit=None):
+        deadline = None if time_limit is None else time.time() + time_limit
+        classes, multiplicities, class_of = self.collapse(pack_genotypes(genotypes))
+        m = classes[0].m
+        bound = self.lower_bound(classes, deadline)
+        # the time limit covers the greedy incumbent and the model as well, which both enumerate
+        # the explaining sets of the genotypes
+        phasing = self.default_phasing(classes)
+        try:
+            with self.profile.stage("greedy incumbent"):
+                phasing = pack_phasing(self.phase_greedy_incremental(classes, deadline)[0])
+            with self.profile.stage("model building"):
+                model = ParsimonyModel(classes, deadline)
+        except TimeLimitReached:
+            parsimony = self.parsimony(phasing)
+            return unpack_phasing(self.expand(phasing, class_of)), parsimony, float(parsimony - bound) / parsimony
+        self.profile.count("candidate haplotypes", len(model.haplotypes))
+        self.profile.count("phase variables", sum(len(phases) for phases in model.phases))
+        incumbent = [model.choice_of(g, phasing[g][0].bits, phasing[g][1].bits) for g in xrange(model.n)]
+        if deadline is not None:
+            time_limit = max(0, deadline - time.time())
+        with self.profile.stage("solving"):
+            if model.objective(incumbent) <= bound:
+                choice, parsimony, lower_bound = incumbent, model.objective(incumbent), bound
+            else:
+                choice, parsimony, lower_bound = model.solve_branch_and_bound(incumbent, time_limit, bound)
+        lower_bound = max(lower_bound, bound)
+        phasing = []
+        for g in xrange(model.n):
+            hap_one, hap_two = model.phase_bits(choice, g)
+            phasing.append(PackedPhase(PackedHaplotype(hap_one, m), PackedHaplotype(hap_two, m)))
+        gap = float(parsimony - lower_bound) / parsimony
+        return unpack_phasing(self.expand(phasing, class_of)), parsimony, gap
 
     # Here's a greedy algorithm for phasing, aimed at minimizing the persimony of the result
     # (although here the greed is NOT always optimal)
@@ -161,31 +579,251 @@ class Phaser:
     #       count how many unresolved genotypes each of our 2^m haplotypes explains
     #       let h = the haplotype that explains the highest number of genotypes
     #       apply h to each of the genotypes that it can explain (resolving it with the complement of h)
+    # Duplicate genotypes are collapsed into classes first (see collapse); each class counts as many
+    # times as it appears, so the result is the same as counting the genotypes one by one
     def phase_greedy(self, genotypes):
+        if self.vectorized:
+            return self.phase_greedy_vectorized(genotypes)
+        classes, multiplicities, class_of = self.collapse(self.pack(genotypes))
+        m = classes[0].m
+        with self.profile.stage("candidate generation"):
+            haps = self.generate_packed_haplotypes(m) if self.packed else self.generate_haplotypes(m)
+        unresolved_classes = range(len(classes))
+        class_phasing = [None] * len(classes)
+        while unresolved_classes:
+            self.profile.count("rounds")
+            self.profile.count("haplotypes scanned", len(haps))
+            self.profile.count("explain tests", len(haps) * len(unresolved_classes))
+            with self.profile.stage("counting"):
+                # zero out all counts
+                count = [0] * len(haps)
+                # count the number of times each haplotype explains any of the unresolved genotypes
+                for h in xrange(len(haps)):
+                    for c in unresolved_classes:
+                        if haps[h].explains(classes[c]):
+                            count[h] += multiplicities[c]
+                # get the best haplotype (greedily)
+                best_haplotype = haps[count.index(max(count))]
+            with self.profile.stage("resolution"):
+                # resolve those which we can with this haplotype
+                for c in unresolved_classes:
+                    if best_haplotype.explains(classes[c]):
+                        class_phasing[c] = self.new_phase(copy.copy(best_haplotype), best_haplotype.complement(classes[c]))
+                unresolved_classes = [c for c in unresolved_classes if class_phasing[c] is None]
+        self.profile.count("complements", len(classes))
+        phasing = self.expand(class_phasing, class_of)
+        return self.unpack(phasing), self.parsimony(phasing)
+
+    # Same greedy algorithm as above (and the same result), but incremental:
+    # we only ever consider haplotypes which explain at least one genotype, and keep their
+    # explain counts in a heap which is updated as genotypes get resolved instead of recounted
+    # Pseudocode:
+    #   for each genotype, for each of the 2^k haplotypes explaining it:
+    #       remember the genotype in that haplotype's list and increment its count
+    #   while there are unresolved genotypes
+    #       pop the haplotype with the highest count off the heap (ties go to the lowest bits,
+    #           which is the order the 2^m haplotypes are scanned in above)
+    #       resolve each unresolved genotype in its list with it and its complement
+    #       decrement the count of every haplotype explaining a genotype we just resolved
+    # This is O(sum of 2^k log) over the genotypes, so it depends on heterozygosity rather than on m
+    # (like phase_greedy, this works on classes of duplicate genotypes weighted by their multiplicity)
+    # With a deadline (a time.time() value) it raises TimeLimitReached once the deadline has passed,
+    # for the exact algorithms which start from the greedy phasing
+    def phase_greedy_incremental(self, genotypes, deadline=None):
+        genotypes, multiplicities, class_of = self.collapse(pack_genotypes(genotypes))
         n = len(genotypes)
         m = genotypes[0].m
-        haps = self.generate_haplotypes(m)
-        unresolved_genotypes = list(genotypes)
-        phasing = [None] * n
-        while unresolved_genotypes:
-            # zero out all counts
-            count = [0] * len(haps)
-            # count the number of times each haplotype explains any of the unresolved genotypes
-            for h in xrange(len(haps)):
-                for g in unresolved_genotypes:
-                    if haps[h].explains(g):
-                        count[h] += 1
-            # get the best haplotype (greedily)
-            best_haplotype = haps[count.index(max(count))]
-            # resolve those which we can with this haplotype; keep track of which genotypes we resolved
-            resolved_genotypes = []
+        explained = {}  # maps haplotype bits to the indices of the genotypes it explains
+        count = {}      # maps haplotype bits to the number of unresolved genotypes it explains
+        with self.profile.stage("candidate generation"):
             for i in xrange(n):
-                if phasing[i] == None and best_haplotype.explains(genotypes[i]):
-                    resolved_genotypes.append(genotypes[i])
-                    phasing[i] = Phase(copy.copy(best_haplotype), best_haplotype.complement(genotypes[i]))
-            for to_remove in resolved_genotypes:
-                unresolved_genotypes[:] = [g for g in unresolved_genotypes if g != to_remove]
-        return phasing, self.parsimony(phasing)
+                for bits in until_deadline(genotypes[i].explaining_bits(), deadline):
+                    if bits in explained:
+                        explained[bits].append(i)
+                    else:
+                        explained[bits] = [i]
+                    count[bits] = count.get(bits, 0) + multiplicities[i]
+            heap = [(-c, bits) for bits, c in count.iteritems()]
+            heapq.heapify(heap)
+        self.profile.count("candidate haplotypes", len(count))
+        phasing = [None] * n
+        unresolved = n
+        pops = 0
+        with self.profile.stage("resolution"):
+            while unresolved:
+                negative_count, best_bits = heapq.heappop(heap)
+                pops += 1
+                # skip stale heap entries, whose count has gone down since they were pushed
+                if -negative_count != count[best_bits]:
+                    continue
+                best_haplotype = PackedHaplotype(best_bits, m)
+                for i in explained[best_bits]:
+                    if phasing[i] is not None:
+                        continue
+                    phasing[i] = PackedPhase(best_haplotype, best_haplotype.complement(genotypes[i]))
+                    unresolved -= 1
+                    for bits in until_deadline(genotypes[i].explaining_bits(), deadline):
+                        count[bits] -= multiplicities[i]
+                        if count[bits] > 0:
+                            heapq.heappush(heap, (-count[bits], bits))
+        self.profile.count("heap pops", pops)
+        self.profile.count("complements", n)
+        phasing = self.expand(phasing, class_of)
+        return unpack_phasing(phasing), self.parsimony(phasing)
+
+    # Same greedy algorithm again (and the same result), with the counting done by numpy
+    # The genotypes are an n x m int8 matrix and the candidate haplotypes (those explaining at least
+    # one genotype, in the order phase_greedy scans them) a c x m int8 matrix
+    # A haplotype explains a genotype if it has no alt allele at a homozygous ref site and no ref
+    # allele at a homozygous alt site, so the c x n explains matrix is two matrix products
+    # Each round is then an argmax over the counts, plus a masked update of the unresolved genotypes
+    # and the counts for the genotypes we just resolved
+    # The rows of the genotype matrix are the classes of duplicate genotypes, weighted by multiplicity
+    def phase_greedy_vectorized(self, genotypes):
+        if numpy is None:
+            raise ValueError("the vectorized backend requires numpy")
+        packed_genotypes, multiplicities, class_of = self.collapse(pack_genotypes(genotypes))
+        n = len(packed_genotypes)
+        m = genotypes[0].m
+        geno_matrix = numpy.array([g.data for g in packed_genotypes], dtype=numpy.int8)
+        weights = numpy.array(multiplicities, dtype=numpy.int64)
+        with self.profile.stage("candidate generation"):
+            candidate_bits = sorted(set(bits for g in packed_genotypes for bits in g.explaining_bits()))
+        self.profile.count("candidate haplotypes", len(candidate_bits))
+        if m < 63:
+            shifts = numpy.arange(m - 1, -1, -1, dtype=numpy.int64)
+            hap_matrix = ((numpy.array(candidate_bits, dtype=numpy.int64)[:, None] >> shifts) & 1).astype(numpy.int8)
+        else:
+            hap_matrix = numpy.array([PackedHaplotype(bits, m).data for bits in candidate_bits], dtype=numpy.int8)
+        # count the conflicting sites between every haplotype and every genotype
+        homo_ref = (geno_matrix == Genotype.HOMO_REF).astype(numpy.int32)
+        homo_alt = (geno_matrix == Genotype.HOMO_ALT).astype(numpy.int32)
+        hetero = (geno_matrix == Genotype.HETERO)
+        with self.profile.stage("explains matrix"):
+            conflicts = hap_matrix.astype(numpy.int32).dot(homo_ref.T) + (1 - hap_matrix).astype(numpy.int32).dot(homo_alt.T)
+            explains = (conflicts == 0)
+            count = explains.dot(weights)
+        self.profile.count("explain tests", explains.size)
+        unresolved = numpy.ones(n, dtype=bool)
+        hap_one = numpy.zeros((n, m), dtype=numpy.int8)
+        with self.profile.stage("resolution"):
+            while unresolved.any():
+                self.profile.count("rounds")
+                # argmax picks the first of the best haplotypes, like phase_greedy
+                best = count.argmax()
+                resolved = explains[best] & unresolved
+                hap_one[resolved] = hap_matrix[best]
+                unresolved &= ~resolved
+                count -= explains[:, resolved].dot(weights[resolved])
+        # the complement flips the heterozygous sites
+        hap_two = numpy.where(hetero, 1 - hap_one, hap_one)
+        class_phasing = HaplotypeMatrix(numpy.stack([hap_one, hap_two], axis=1), trusted=True)
+        # every class appears in the phasing, so it has the same haplotypes as the classes
+        return self.expand(class_phasing.to_phases(), class_of), class_phasing.parsimony()
+
+    # Clark's rule-based inference algorithm, which needs no reference data and never looks at
+    # haplotypes which are not in the phasing
+    # Pseudocode:
+    #   resolve every genotype with at most one ambiguous site (it only has one phase) and put
+    #       both of its haplotypes in the pool of known haplotypes
+    #   while there are unresolved genotypes
+    #       for each unresolved genotype, if a known haplotype explains it:
+    #           resolve it with that haplotype (preferring one whose complement is known too)
+    #           and put the complement in the pool
+    #       if that resolved nothing, resolve the unresolved genotype with the fewest ambiguous
+    #           sites with its first phase (REF at every ambiguous site), which seeds the pool again
+    # The pool is indexed by allele at each SNP (see pool.py), so finding the known haplotypes which
+    # explain a genotype is O(m) whatever the size of the pool; with few distinct haplotypes most
+    # genotypes are resolved in the first pass or two, so this is close to linear in n
+    # (like the other algorithms, this works on classes of duplicate genotypes)
+    def phase_clark(self, genotypes):
+        classes, multiplicities, class_of = self.collapse(pack_genotypes(genotypes))
+        m = classes[0].m
+        pool = HaplotypePool(m)
+        class_phasing = [None] * len(classes)
+        def resolve(c, bits):
+            het = classes[c].het
+            class_phasing[c] = PackedPhase(PackedHaplotype(bits, m), PackedHaplotype(bits ^ het, m))
+            pool.add(bits)
+            pool.add(bits ^ het)
+        unresolved = []
+        with self.profile.stage("seeding"):
+            for c in xrange(len(classes)):
+                het = classes[c].het
+                if het & (het - 1) == 0:
+                    resolve(c, classes[c].alt)
+                else:
+                    unresolved.append(c)
+        self.profile.count("unambiguous genotypes", len(classes) - len(unresolved))
+        with self.profile.stage("inference"):
+            while unresolved:
+                self.profile.count("passes")
+                still_unresolved = []
+                for c in unresolved:
+                    het = classes[c].het
+                    explaining = pool.explaining(classes[c])
+                    if not explaining:
+                        still_unresolved.append(c)
+                        continue
+                    bits = explaining[0]
+                    for h in explaining:
+                        if h ^ het in pool:
+                            bits = h
+                            break
+                    resolve(c, bits)
+                if len(still_unresolved) == len(unresolved):
+                    c = min(still_unresolved, key=lambda c: bin(classes[c].het).count("1"))
+                    self.profile.count("orphans")
+                    resolve(c, classes[c].alt)
+                    still_unresolved.remove(c)
+                unresolved = still_unresolved
+        self.profile.count("pool haplotypes", len(pool))
+        phasing = self.expand(class_phasing, class_of)
+        return unpack_phasing(phasing), self.parsimony(phasing)
+
+    # Expectation-maximization over haplotype frequencies, with partition-ligation (see em.py)
+    # Estimates the frequency of every candidate haplotype (those consistent with the genotypes)
+    # and gives each genotype its most likely phase under those frequencies; this does not
+    # minimize parsimony directly, but likely phases are made of common haplotypes
+    # Pseudocode:
+    #   split the SNPs into blocks of block_size SNPs
+    #   for each block: run EM over all the phases of the genotypes in the block, then drop the
+    #       haplotypes with frequency below min_frequency (unless some genotype's best phase uses them)
+    #   while there is more than one segment:
+    #       ligate adjacent pairs of segments (joining the phases kept on either side in both
+    #       orientations), then run EM on each and prune it again
+    #   run EM on the last segment and give each genotype its most likely phase
+    # Everything is numpy arrays of haplotype indices until the end, and the genotypes are collapsed
+    # into classes weighted by multiplicity, so thousands of individuals take a few seconds
+    def phase_em(self, genotypes, block_size=8, iterations=100, min_frequency=0.001):
+        if numpy is None:
+            raise ValueError("the EM phaser requires numpy")
+        classes, multiplicities, class_of = self.collapse(pack_genotypes(genotypes))
+        m = classes[0].m
+        c = len(classes)
+        weights = numpy.array(multiplicities, dtype=numpy.float64)
+        def estimate_and_prune(segment):
+            self.profile.count("candidate phases", len(segment.owner))
+            frequencies, posterior = estimate_frequencies(segment, weights, iterations)
+            return prune(segment, frequencies, best_phases(segment, posterior, c), min_frequency)
+        with self.profile.stage("blocks"):
+            segments = [estimate_and_prune(block_segment(classes, start, min(start + block_size, m), self.ambiguous_assignments))
+                    for start in xrange(0, m, block_size)]
+        self.profile.count("blocks", len(segments))
+        with self.profile.stage("ligation"):
+            while len(segments) > 1:
+                ligated = [estimate_and_prune(ligate_segments(segments[i], segments[i + 1], c))
+                        for i in xrange(0, len(segments) - 1, 2)]
+                if len(segments) % 2:
+                    ligated.append(segments[-1])
+                segments = ligated
+        segment = segments[0]
+        with self.profile.stage("final estimate"):
+            frequencies, posterior = estimate_frequencies(segment, weights, iterations)
+            best = best_phases(segment, posterior, c)
+        class_phasing = HaplotypeMatrix(numpy.stack([segment.haplotypes[segment.one[best]],
+                segment.haplotypes[segment.two[best]]], axis=1), trusted=True)
+        return self.expand(class_phasing.to_phases(), class_of), class_phasing.parsimony()
 
     # Here's an alternative greedy algorithm for phasing utilizing a couple hash lookup tables
     # We use one hash table to store frequency information of phases (haplotype pairs) from reference (HapMap) data;
@@ -194,37 +832,239 @@ class Phaser:
     # we fill this table each time we phase a new genotype
     # This lets us scale to a high number of individuals (and a high number of SNPs if the genotype
     # diveristy is relatively low)
-    def phase_hash(self, genotypes, reference_phases):
+    # reference_phases can also be a precompiled ReferencePanel (see panel.py), which already has
+    # the phase count hash table (for packed phases)
+    # A genotype none of whose phases is in the reference data gets the phase made of the closest
+    # pair of reference haplotypes instead (see nearest_phase)
+    # By default we use phase_hash_indexed, which gives the same result without enumerating phases;
+    # pass indexed=False to enumerate the 2^(k-1) phases of each genotype as described above
+    # resolutions, if given, is the resolution hash table to use (see phase_hash_indexed)
+    def phase_hash(self, genotypes, reference_phases, indexed=True, resolutions=None):
+        if indexed:
+            return self.phase_hash_indexed(genotypes, reference_phases, resolutions)
+        if isinstance(reference_phases, ReferencePanel):
+            genotypes = pack_genotypes(genotypes)
+            phase_count_hash = reference_phases.phase_counts
+            trie = reference_phases.haplotype_trie
+        else:
+            genotypes = self.pack(genotypes)
+            if self.packed:
+                reference_phases = pack_phasing(reference_phases)
+            # Create our phase count hash table
+            # which maps a phase (haplotype pair) to its count in the reference data
+            with self.profile.stage("reference counting"):
+                phase_count_hash = {}
+                for phase in reference_phases:
+                    if phase in phase_count_hash:
+                        phase_count_hash[phase] += 1
+                    else:
+                        phase_count_hash[phase] = 1
+            trie = lambda: ReferencePanel.from_phases(reference_phases).haplotype_trie()
         n = len(genotypes)
         m = genotypes[0].m
         phasing = []
-        # Create our phase count hash table
-        # which maps a phase (haplotype pair) to its count in the reference data
-        phase_count_hash = {}
-        for phase in reference_phases:
-            if phase in phase_count_hash:
-                phase_count_hash[phase] += 1
-            else:
-                phase_count_hash[phase] = 1
         # Create our (initially empty) resolution hash table
         # which maps a genotype to the phase to choose
         geno_phase_hash = {}
         # Start phasing!
-        for genotype in genotypes:
-            if genotype in geno_phase_hash:
-                phasing.append(geno_phase_hash[genotype])
+        with self.profile.stage("phasing"):
+            for genotype in genotypes:
+                if genotype in geno_phase_hash:
+                    self.profile.count("genotype cache hits")
+                    phasing.append(geno_phase_hash[genotype])
+                else:
+                    # Generate all ways to phase this genotype
+                    phases = self.generate_valid_haplotype_phases(genotype)
+                    best_phase = phases[0]
+                    best_count = 0
+                    for p in phases:
+                        if p in phase_count_hash:
+                            if phase_count_hash[p] > best_count:
+                                best_count = phase_count_hash[p]
+                                best_phase = p
+                    self.profile.count("hash probes", len(phases))
+                    self.profile.count("hash hits" if best_count else "hash misses")
+                    if not best_count:
+                        if not isinstance(trie, HaplotypeTrie):
+                            with self.profile.stage("reference trie"):
+                                trie = trie()
+                        best_phase = self.nearest_phase(trie, genotype)
+                    # Now we will phase this genotype using best_phase
+                    # and we will remember this phase in geno_phase_hash
+                    phasing.append(best_phase)
+                    geno_phase_hash[genotype] = best_phase
+        return unpack_phasing(phasing), self.parsimony(phasing)
+
+    # The phase of a genotype made of the closest pair of reference haplotypes in a HaplotypeTrie
+    # (see haplotrie.py), as a Phase or PackedPhase like the genotype
+    def nearest_phase(self, trie, genotype):
+        packed = genotype if isinstance(genotype, PackedGenotype) else PackedGenotype.from_genotype(genotype)
+        bits, distance = trie.nearest_phase(packed)
+        self.profile.count("nearest phase distance", distance or 0)
+        phase = PackedPhase(PackedHaplotype(bits, packed.m), PackedHaplotype(bits ^ packed.het, packed.m))
+        return phase if packed is genotype else phase.to_phase()
+
+    # Phase long sequences of SNPs by phasing overlapping windows of them separately
+    # algorithm is the name of the phasing method to use on each window (e.g. "phase_greedy_incremental");
+    # if reference_phases are given they are cut into the same windows and passed along too
+    # (for "phase_hash")
+    # Adjacent windows share overlap SNPs, which are used to ligate each individual's window phases
+    # together (see windows.py), so the cost grows linearly with m for a fixed window size
+    # The windows are phased by self.jobs worker processes
+    def phase_windowed(self, genotypes, algorithm, window_size, overlap, reference_phases=None):
+        n = len(genotypes)
+        m = genotypes[0].m
+        bounds = window_bounds(m, window_size, overlap)
+        phase_cache = self.unit_phase_cache(len(bounds))
+        units = []
+        for start, end in bounds:
+            window_genotypes = [slice_genotype(g, start, end) for g in genotypes]
+            if reference_phases is None:
+                arguments = ()
             else:
-                # Generate all ways to phase this genotype
-                phases = self.generate_valid_haplotype_phases(genotype)
-                best_phase = phases[0]
-                best_count = 0
-                for p in phases:
-                    if p in phase_count_hash:
-                        if phase_count_hash[p] > best_count:
-                            best_count = phase_count_hash[p]
-                            best_phase = p
-                # Now we will phase this genotype using best_phase
-                # and we will remember this phase in geno_phase_hash
-                phasing.append(best_phase)
-                geno_phase_hash[genotype] = best_phase
+                arguments = ([slice_phase(p, start, end) for p in reference_phases],)
+            units.append((algorithm, self.packed, self.vectorized, phase_cache, window_genotypes, arguments))
+        self.profile.count("windows", len(bounds))
+        with self.profile.stage("windows"):
+            window_phasings = self.map(phase_unit, units)
+        with self.profile.stage("ligation"):
+            phasing = [ligate([window_phasing[i] for window_phasing in window_phasings], bounds) for i in xrange(n)]
         return phasing, self.parsimony(phasing)
+
+    # Split genotypes into the connected components of their compatibility graph, in which two
+    # genotypes are adjacent when some haplotype explains both (see bounds.compatible)
+    # A haplotype explaining genotypes of two components would join them, so no haplotype can be
+    # shared between components: they can be phased independently, and their parsimonies add up
+    # Returns the components as lists of genotype indices, in order of first appearance
+    def components(self, genotypes):
+        classes, multiplicities, class_of = self.collapse(pack_genotypes(genotypes))
+        n = len(classes)
+        parent = range(n)   # union-find forest over the classes
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+        with self.profile.stage("decomposition"):
+            for i in xrange(n):
+                for j in xrange(i):
+                    # pairs already in the same component need no test
+                    root_i, root_j = find(i), find(j)
+                    if root_i != root_j and compatible(classes[i], classes[j]):
+                        parent[max(root_i, root_j)] = min(root_i, root_j)
+            components = []
+            component_of = {}   # maps root class to its index in components
+            for i, c in enumerate(class_of):
+                root = find(c)
+                if root not in component_of:
+                    component_of[root] = len(components)
+                    components.append([])
+                components[component_of[root]].append(i)
+        self.profile.count("components", len(components))
+        return components
+
+    # Phase each connected component of the genotypes (see components) on its own with one of
+    # the phasing methods (by name, e.g. "phase_branch_and_bound"), passing it the extra arguments
+    # (e.g. a time limit, which then applies to each component)
+    # The components are phased by self.jobs worker processes; the parsimony is the sum of theirs,
+    # and the phasing is optimal if each component's phasing is
+    # Returns (phasing, parsimony), and for methods returning a third value, whether every component's
+    # phasing is optimal (for phase_ilp, the gap over all of them)
+    def phase_decomposed(self, genotypes, algorithm, *arguments):
+        components = self.components(genotypes)
+        phase_cache = self.unit_phase_cache(len(components))
+        units = [(algorithm, self.packed, self.vectorized, phase_cache, [genotypes[i] for i in component], arguments)
+                for component in components]
+        with self.profile.stage("components"):
+            results = self.map(phase_component, units)
+        phasing = [None] * len(genotypes)
+        for component, result in zip(components, results):
+            for i, phase in zip(component, result[0]):
+                phasing[i] = phase
+        parsimony = sum(result[1] for result in results)
+        if len(results[0]) < 3:
+            return phasing, parsimony
+        if isinstance(results[0][2], bool):
+            return phasing, parsimony, all(result[2] for result in results)
+        # gap = (parsimony - lower bound) / parsimony, and the lower bounds add up too
+        return phasing, parsimony, sum(result[2] * result[1] for result in results) / float(parsimony)
+
+    # Same as phase_hash (and the same result), but with the reference phases indexed up front by
+    # the genotype they induce, along with the most common phase for each genotype
+    # Only reference phases whose genotype equals ours can ever match, so resolving a new genotype
+    # is a single O(m) lookup instead of 2^(k-1) phase constructions and probes
+    # Genotypes no reference phase explains are resolved through the reference haplotype trie
+    # (see nearest_phase), which is only built once there is such a genotype
+    # resolutions is the resolution hash table (mapping packed genotype to packed phase) to use and
+    # fill in; a caller phasing many batches against the same reference data (e.g. phaseserver.py)
+    # can keep it between calls, so a genotype is only ever resolved once
+    def phase_hash_indexed(self, genotypes, reference_phases, resolutions=None):
+        genotypes = pack_genotypes(genotypes)
+        with self.profile.stage("reference index"):
+            if not isinstance(reference_phases, ReferencePanel):
+                reference_phases = ReferencePanel.from_phases(reference_phases)
+            index = reference_phases.genotype_index()
+        m = genotypes[0].m
+        phasing = []
+        geno_phase_hash = {} if resolutions is None else resolutions
+        hits = misses = 0
+        with self.profile.stage("phasing"):
+            for genotype in genotypes:
+                if genotype not in geno_phase_hash:
+                    if genotype in index:
+                        bits = index[genotype][1]
+                        geno_phase_hash[genotype] = PackedPhase(PackedHaplotype(bits, m), PackedHaplotype(bits ^ genotype.het, m))
+                        hits += 1
+                    else:
+                        if reference_phases.trie is None:
+                            with self.profile.stage("reference trie"):
+                                reference_phases.haplotype_trie()
+                        geno_phase_hash[genotype] = self.nearest_phase(reference_phases.trie, genotype)
+                        misses += 1
+                phasing.append(geno_phase_hash[genotype])
+        self.profile.count("hash hits", hits)
+        self.profile.count("hash misses", misses)
+        self.profile.count("genotype cache hits", len(genotypes) - hits - misses)
+        return unpack_phasing(phasing), self.parsimony(phasing)
+
+# Work unit functions for Phaser.map
+# These live at module level so that they can be sent to worker processes
+
+# The phase caches of this worker process by size, shared by the work units it runs (e.g. by the
+# windows of a genome)
+worker_phase_caches = {}
+
+# A phaser for a work unit; phase_cache is the phase cache to use, or the size of the worker's
+# cache to use (see Phaser.unit_phase_cache)
+def unit_phaser(packed, vectorized=False, phase_cache=None):
+    if not isinstance(phase_cache, PhaseCache):
+        if phase_cache not in worker_phase_caches:
+            worker_phase_caches[phase_cache] = PhaseCache(phase_cache)
+        phase_cache = worker_phase_caches[phase_cache]
+    return Phaser(packed, vectorized, phase_cache=phase_cache)
+
+# Phase a list of genotypes: unit is (method name, packed, vectorized, phase cache or its size,
+# genotypes, extra arguments)
+# Returns the whole result of the method (the phasing, its parsimony and anything after them)
+def phase_component(unit):
+    algorithm, packed, vectorized, phase_cache, genotypes, arguments = unit
+    return getattr(unit_phaser(packed, vectorized, phase_cache), algorithm)(genotypes, *arguments)
+
+# Same, but returns just the phasing
+def phase_unit(unit):
+    return phase_component(unit)[0]
+
+# Find the best phasing in one part of the valid phasings
+# unit is (packed, phase cache or its size, genotypes, part, parts, preferred haplotypes or None,
+# time limit or None, progress function or None, lower bound)
+# Returns (phasing, parsimony, whether the part was finished), with (None, None) if the part is empty
+# or time ran out before its phases were generated
+def phase_candidates_part(unit):
+    packed, phase_cache, genotypes, part, parts, preferred, time_limit, progress, lower_bound = unit
+    phaser = unit_phaser(packed, phase_cache=phase_cache)
+    deadline = None if time_limit is None else time.time() + time_limit
+    try:
+        phasings = phaser.iter_valid_phasings(genotypes, part, parts, preferred, deadline)
+    except TimeLimitReached:
+        return None, None, False
+    return phaser.scan_phasings(phasings, deadline=deadline, progress=progress, lower_bound=lower_bound)
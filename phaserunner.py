@@ -6,19 +6,37 @@ Contains a class that we can use which wraps the phaser class so that we can eas
 Author: Ryan Baker
 """
 
-from genotype import Genotype
-from haplotype import Haplotype
 from phase import Phase
 from phaser import Phaser
-import time
+from hapmap import HapMap
+from panel import ReferencePanel
+from genotypefile import read_genotype_chunks, write_phasing
+from matrix import HaplotypeMatrix
+from timeit import default_timer as timer
 import random
 
+# The algorithms (see PhaseRunner.algorithms) which find a minimum parsimony phasing given enough time
+EXACT_ALGORITHMS = ("exhaustive", "branch-and-bound", "ilp")
+
 class PhaseRunner:
 
-    def __init__(self):
-        self.phaser = Phaser()
+    # If profile is set, self.phaser.profile holds the profile of the last run (see profiling.py)
+    # phase_cache is the PhaseCache for the phase enumerations (see phasecache.py)
+    # If bound is set, each run also computes a lower bound on the parsimony (see certify)
+    def __init__(self, packed=False, vectorized=False, jobs=1, profile=False, phase_cache=None, bound=False):
+        self.phaser = Phaser(packed, vectorized, jobs, profile, phase_cache)
+        self.hapmaps = {}   # maps file name to its loaded HapMap, so each file is only read once
+        self.optimal = None     # whether the phasing of the last run is known to be optimal (None if unknown)
+        self.bound = bound
+        self.lower_bound = None # lower bound on the parsimony of the genotypes of the last run (see bounds.py)
         return
 
+    # Get the (single pass, lazily parsed) data of a hapmap file
+    def hapmap(self, filename):
+        if filename not in self.hapmaps:
+            self.hapmaps[filename] = HapMap(filename)
+        return self.hapmaps[filename]
+
     def random_phase_data(self, n, m, p):
         real_phase_data = []
         # generate a pool of haplotypes
@@ -32,33 +50,27 @@ class PhaseRunner:
         real_parsimony = self.phaser.parsimony(real_phase_data)
         return real_phase_data, real_parsimony
 
+    # With the vectorized backend, the data goes through HaplotypeMatrix/GenotypeMatrix (see matrix.py)
+    # in file_phase_data, to_genotypes and get_accuracy, rather than through per-element Python loops
+
     def file_phase_data(self, filename, n, m):
-        real_phase_data = []
-        # grab haplotype data from input file
-        hapfile = open(filename)
-        data = []
-        # throw away first line and first two columns
-        hapfile.readline()
-        for i in xrange(m):
-            data.append(hapfile.readline().split()[2:])
-        # now parse out the haplotypes!
-        for i_n in xrange(n):       # for each individual
-            hap_one_data = []
-            hap_two_data = []
-            for i_m in xrange(m):   # for each SNP
-                # arbitrarily assign 0 to the SNP that individual number 0 has at this SNP position
-                ref_snp = data[i_m][0]
-                hap_one_data.append(0 if data[i_m][i_n * 2] == ref_snp else 1)
-                hap_two_data.append(0 if data[i_m][i_n * 2 + 1] == ref_snp else 1)
-            real_phase_data.append(Phase(Haplotype(list(hap_one_data)), Haplotype(list(hap_two_data))))
+        # grab the first n individuals over the first m SNPs from the input file
+        if self.phaser.vectorized:
+            truth = HaplotypeMatrix.from_hapmap(self.hapmap(filename), xrange(n), xrange(m))
+            return truth.to_phases(), truth.parsimony()
+        real_phase_data = self.hapmap(filename).phases(xrange(n), xrange(m))
         real_parsimony = self.phaser.parsimony(real_phase_data)
         return real_phase_data, real_parsimony
 
     def to_genotypes(self, real_phase_data):
         # now turn the haplotype data into genotypes, which we will try to phase
+        if self.phaser.vectorized:
+            return HaplotypeMatrix.from_phases(real_phase_data).to_genotypes().to_genotypes()
         return [real_phase_data[i_n].to_genotype() for i_n in xrange(len(real_phase_data))]
 
     def get_accuracy(self, real_phase_data, phasing):
+        if self.phaser.vectorized:
+            return HaplotypeMatrix.from_phases(phasing).accuracy(HaplotypeMatrix.from_phases(real_phase_data))
         total_phases = len(real_phase_data)
         correct_phases = 0
         for i_n in xrange(total_phases):
@@ -67,56 +79,225 @@ class PhaseRunner:
         accuracy = float(correct_phases)/float(total_phases)
         return correct_phases, total_phases, accuracy
 
-    def run_greedy(self, n, m, hapmapfile, random=False, p=None):
+    # Get the true phasing to test against, from a hapmap file or from a random haplotype pool
+    def input_phase_data(self, n, m, hapmapfile, random=False, p=None):
         if not random:
-            real_phase_data, real_parsimony = self.file_phase_data(hapmapfile, n, m)
+            return self.file_phase_data(hapmapfile, n, m)
         else:
-            real_phase_data, real_parsimony = self.random_phase_data(n, m, p)
+            return self.random_phase_data(n, m, p)
+
+    # Time a phasing algorithm (any Phaser method taking a list of genotypes) on our input data
+    # If the algorithm returns a third value, it is whether the phasing is optimal (see exact_algorithm);
+    # anything else it returns after the phasing and its parsimony is ignored
+    def run_algorithm(self, algorithm, n, m, hapmapfile, random=False, p=None):
+        real_phase_data, real_parsimony = self.input_phase_data(n, m, hapmapfile, random, p)
         genotypes = self.to_genotypes(real_phase_data)
-        start_time = time.time()
-        phasing, parsimony = self.phaser.phase_greedy(genotypes)
-        end_time = time.time()
+        self.phaser.profile.reset()
+        start_time = timer()
+        result = algorithm(genotypes)
+        end_time = timer()
+        phasing, parsimony = result[:2]
+        self.optimal = result[2] if len(result) > 2 else None
+        self.certify(genotypes, parsimony)
         elapsed_time = end_time - start_time
         return elapsed_time, self.get_accuracy(real_phase_data, phasing), (parsimony, real_parsimony), real_phase_data, phasing
 
-    def run_exhaustive(self, n, m, hapmapfile, random=False, p=None):
-        if not random:
-            real_phase_data, real_parsimony = self.file_phase_data(hapmapfile, n, m)
-        else:
-            real_phase_data, real_parsimony = self.random_phase_data(n, m, p)
+    def run_greedy(self, n, m, hapmapfile, random=False, p=None):
+        return self.run_algorithm(self.phaser.phase_greedy, n, m, hapmapfile, random, p)
+
+    def run_greedy_incremental(self, n, m, hapmapfile, random=False, p=None):
+        return self.run_algorithm(self.phaser.phase_greedy_incremental, n, m, hapmapfile, random, p)
+
+    def run_clark(self, n, m, hapmapfile, random=False, p=None):
+        return self.run_algorithm(self.phaser.phase_clark, n, m, hapmapfile, random, p)
+
+    def run_em(self, n, m, hapmapfile, random=False, p=None):
+        return self.run_algorithm(self.phaser.phase_em, n, m, hapmapfile, random, p)
+
+    # The exact algorithms take a time limit (in seconds), after which they return the best phasing
+    # found so far, and a progress function (see Phaser.scan_phasings; ignored by ilp)
+    # self.optimal then says whether the phasing was proven optimal
+
+    def run_exhaustive(self, n, m, hapmapfile, random=False, p=None, time_limit=None, progress=None):
+        return self.run_algorithm(self.exact_algorithm("exhaustive", time_limit, progress), n, m, hapmapfile, random, p)
+
+    def run_branch_and_bound(self, n, m, hapmapfile, random=False, p=None, time_limit=None, progress=None):
+        return self.run_algorithm(self.exact_algorithm("branch-and-bound", time_limit, progress), n, m, hapmapfile, random, p)
+
+    def run_ilp(self, n, m, hapmapfile, random=False, p=None, time_limit=None):
+        return self.run_algorithm(self.exact_algorithm("ilp", time_limit), n, m, hapmapfile, random, p)
+
+    # One of the exact algorithms (by name, see EXACT_ALGORITHMS) with a time limit, as a function
+    # of the genotypes returning (phasing, parsimony, optimal)
+    def exact_algorithm(self, algorithm, time_limit=None, progress=None):
+        if algorithm == "ilp":
+            def ilp(genotypes):
+                phasing, parsimony, gap = self.phaser.phase_ilp(genotypes, time_limit)
+                return phasing, parsimony, gap == 0
+            return ilp
+        return lambda genotypes: self.algorithms()[algorithm](genotypes, time_limit, progress)
+
+    # Compute the lower bound on the parsimony of the genotypes of a run (after timing it), which
+    # proves the phasing optimal if its parsimony matches it, whatever algorithm found it
+    # Only done if self.bound is set; otherwise the lower bound is None
+    def certify(self, genotypes, parsimony):
+        if not self.bound:
+            self.lower_bound = None
+            return
+        self.lower_bound = self.phaser.lower_bound(genotypes)
+        if parsimony <= self.lower_bound:
+            self.optimal = True
+
+    # If panelfile is given, the reference data comes from the precompiled panel saved there
+    # (which is rebuilt if it is missing or was built from a different hapmap file)
+    def run_hash(self, n, m, hapmapfile, random=False, p=None, panelfile=None):
+        real_phase_data, real_parsimony = self.input_phase_data(n, m, hapmapfile, random, p)
         genotypes = self.to_genotypes(real_phase_data)
-        start_time = time.time()
-        phasing, parsimony = self.phaser.phase_trivial_improved(genotypes)
-        end_time = time.time()
+        # Just use the same input file for the frequency hash table
+        # (loaded before we start timing, like the data we phase)
+        if panelfile is not None:
+            ref_phases = self.reference_panel(panelfile, hapmapfile, m)
+        else:
+            ref_phases = self.file_reference_phases(hapmapfile, m)
+        self.phaser.profile.reset()
+        start_time = timer()
+        phasing, parsimony = self.phaser.phase_hash(genotypes, ref_phases)
+        end_time = timer()
+        self.optimal = None
+        self.certify(genotypes, parsimony)
         elapsed_time = end_time - start_time
         return elapsed_time, self.get_accuracy(real_phase_data, phasing), (parsimony, real_parsimony), real_phase_data, phasing
 
-    def run_hash(self, n, m, hapmapfile, random=False, p=None):
-        if not random:
-            real_phase_data, real_parsimony = self.file_phase_data(hapmapfile, n, m)
-        else:
-            real_phase_data, real_parsimony = self.random_phase_data(n, m, p)
+    # The phases of every individual in a hapmap file (first m SNPs), as reference data for phase_hash
+    def file_reference_phases(self, filename, m):
+        return self.hapmap(filename).phases(snps=xrange(m))
+
+    # The precompiled reference panel of a hapmap file (first m SNPs) saved at panelfile
+    def reference_panel(self, panelfile, filename, m):
+        return ReferencePanel.load_or_build(panelfile, filename, m, lambda: self.file_reference_phases(filename, m))
+
+    # The phasing algorithms by name
+    def algorithms(self):
+        return {
+            "exhaustive": self.phaser.phase_trivial_improved,
+            "branch-and-bound": self.phaser.phase_branch_and_bound,
+            "ilp": self.phaser.phase_ilp,
+            "greedy": self.phaser.phase_greedy,
+            "incremental-greedy": self.phaser.phase_greedy_incremental,
+            "clark": self.phaser.phase_clark,
+            "em": self.phaser.phase_em,
+            "hash": self.phaser.phase_hash,
+        }
+
+    # Run one of the algorithms by name (see algorithms)
+    # time_limit and progress only apply to the exact algorithms (see run_exhaustive)
+    def run(self, algorithm, n, m, hapmapfile, random=False, p=None, time_limit=None, progress=None):
+        if algorithm == "hash":
+            return self.run_hash(n, m, hapmapfile, random, p)
+        if algorithm in EXACT_ALGORITHMS:
+            return self.run_algorithm(self.exact_algorithm(algorithm, time_limit, progress), n, m, hapmapfile, random, p)
+        return self.run_algorithm(self.algorithms()[algorithm], n, m, hapmapfile, random, p)
+
+    # Run one of the algorithms (by name, see algorithms) on overlapping windows of window_size SNPs
+    def run_windowed(self, algorithm, window_size, overlap, n, m, hapmapfile, random=False, p=None):
+        real_phase_data, real_parsimony = self.input_phase_data(n, m, hapmapfile, random, p)
         genotypes = self.to_genotypes(real_phase_data)
-        start_time = time.time()
-        # Just use the same input file for the frequency hash table
-        ref_file = open(hapmapfile)
-        ref_data = []
-        ref_phases = []
-        # throw away first line and first two columns
-        ref_file.readline()
-        for line in ref_file.readlines():
-            ref_data.append(line.split()[2:])
-        # now parse out the haplotypes!
-        for i_n in xrange(0, len(ref_data[0]), 2):       # for each haplotype pair
-            hap_one_data = []
-            hap_two_data = []
-            for i_m in xrange(m):   # for each SNP of interest
-                # arbitrarily assign 0 to the SNP that individual number 0 has at this SNP position
-                ref_snp = ref_data[i_m][0]
-                hap_one_data.append(0 if ref_data[i_m][i_n] == ref_snp else 1)
-                hap_two_data.append(0 if ref_data[i_m][i_n + 1] == ref_snp else 1)
-            ref_phases.append(Phase(Haplotype(list(hap_one_data)), Haplotype(list(hap_two_data))))
-        phasing, parsimony = self.phaser.phase_hash(genotypes, ref_phases)
-        end_time = time.time()
+        ref_phases = None
+        if algorithm == "hash":
+            ref_phases = self.file_reference_phases(hapmapfile, m)
+        self.phaser.profile.reset()
+        start_time = timer()
+        phasing, parsimony = self.phaser.phase_windowed(genotypes, self.algorithms()[algorithm].__name__, window_size, overlap, ref_phases)
+        end_time = timer()
+        self.optimal = None
+        self.certify(genotypes, parsimony)
         elapsed_time = end_time - start_time
         return elapsed_time, self.get_accuracy(real_phase_data, phasing), (parsimony, real_parsimony), real_phase_data, phasing
+
+    # One of the algorithms (by name, see algorithms) phasing each connected component of the
+    # genotypes on its own (see Phaser.phase_decomposed), as a function of the genotypes
+    # returning (phasing, parsimony) and, for the exact algorithms, whether it is optimal
+    # reference is the reference data for hash; time_limit applies to each component
+    def decomposed_algorithm(self, algorithm, reference=None, time_limit=None):
+        method = self.algorithms()[algorithm].__name__
+        if algorithm == "hash":
+            arguments = (reference,)
+        elif algorithm in EXACT_ALGORITHMS:
+            arguments = (time_limit,)
+        else:
+            arguments = ()
+        def decomposed(genotypes):
+            result = self.phaser.phase_decomposed(genotypes, method, *arguments)
+            if algorithm == "ilp":
+                return result[0], result[1], result[2] == 0
+            return result
+        return decomposed
+
+    # Run one of the algorithms (by name, see algorithms) on each connected component of the genotypes
+    # time_limit only applies to the exact algorithms, and to each component
+    def run_decomposed(self, algorithm, n, m, hapmapfile, random=False, p=None, time_limit=None):
+        reference = None
+        if algorithm == "hash":
+            reference = self.file_reference_phases(hapmapfile, m)
+        return self.run_algorithm(self.decomposed_algorithm(algorithm, reference, time_limit), n, m, hapmapfile, random, p)
+
+    # The reference data for one of the algorithms (by name) on genotypes over m SNPs: for hash,
+    # the precompiled panel of hapmapfile saved at panelfile if given, or else its phases
+    # (windows are cut from the phases, so windowed runs always get those); None for the others
+    def reference_data(self, algorithm, hapmapfile, m, panelfile=None, window_size=None):
+        if algorithm != "hash":
+            return None
+        if hapmapfile is None:
+            raise ValueError("the hash algorithm needs a hapmap file of reference phases")
+        if panelfile is not None and not window_size:
+            return self.reference_panel(panelfile, hapmapfile, m)
+        return self.file_reference_phases(hapmapfile, m)
+
+    # Phase a list of genotypes with one of the algorithms (by name, see algorithms), on windows of
+    # window_size SNPs if given, or else on each connected component if decompose is set (see
+    # decomposed_algorithm); reference is the reference data for hash (see reference_data) and
+    # time_limit the time limit for the exact algorithms
+    # resolutions is the resolution hash table for hash to keep between calls (see
+    # Phaser.phase_hash_indexed), used when the genotypes are phased whole
+    # Returns the phasing and its parsimony
+    def phase_genotypes(self, algorithm, genotypes, reference=None, window_size=None, overlap=3, time_limit=None,
+            decompose=False, resolutions=None):
+        if window_size:
+            return self.phaser.phase_windowed(genotypes, self.algorithms()[algorithm].__name__,
+                    window_size, overlap, reference)
+        elif decompose:
+            return self.decomposed_algorithm(algorithm, reference, time_limit)(genotypes)[:2]
+        elif algorithm == "hash":
+            return self.phaser.phase_hash(genotypes, reference, resolutions=resolutions)
+        elif algorithm in EXACT_ALGORITHMS:
+            return self.exact_algorithm(algorithm, time_limit)(genotypes)[:2]
+        return self.algorithms()[algorithm](genotypes)[:2]
+
+    # Phase real (unphased) genotype data: read the genotype file (see genotypefile.py) chunk_size
+    # individuals at a time, phase each chunk with one of the algorithms (by name, see algorithms),
+    # on windows of window_size SNPs if given (or on connected components, if decompose is set),
+    # and write the haplotypes to out as each chunk is done
+    # hash uses the phases in hapmapfile (or its precompiled panel, if panelfile is given) as its reference
+    # Each chunk is phased on its own, so this minimizes parsimony within chunks, not over the whole file
+    # Returns the elapsed time, the number of individuals phased and the sum of the chunks' parsimonies
+    def phase_file(self, algorithm, genofile, out, chunk_size=1000, m=None, window_size=None, overlap=3,
+            hapmapfile=None, panelfile=None, time_limit=None, decompose=False):
+        if algorithm == "hash" and hapmapfile is None:
+            raise ValueError("the hash algorithm needs a hapmap file of reference phases")
+        reference = None
+        n = 0
+        total_parsimony = 0
+        self.phaser.profile.reset()
+        start_time = timer()
+        for genotypes in read_genotype_chunks(genofile, chunk_size, m):
+            # the reference data is loaded once we know m
+            if reference is None:
+                reference = self.reference_data(algorithm, hapmapfile, genotypes[0].m, panelfile, window_size)
+            phasing, parsimony = self.phase_genotypes(algorithm, genotypes, reference, window_size, overlap, time_limit,
+                    decompose)
+            write_phasing(out, phasing)
+            n += len(genotypes)
+            total_parsimony += parsimony
+        end_time = timer()
+        elapsed_time = end_time - start_time
+        return elapsed_time, n, total_parsimony
@@ -0,0 +1,177 @@
+"""
+phaseserver.py
+
+Long-running phasing server, which keeps the reference data warm between requests
+
+Starting haplophase.py costs an interpreter, the imports and reading (and hashing) the reference
+file before a single genotype is phased, which dominates when phasing many small batches. The
+server does that once: it keeps the hapmap files, the reference panels (with their phase count
+hash tables and the genotype index that resolves genotypes), the genotypes hash has resolved
+against each panel and the phase cache in memory, and phases batches sent to it over a Unix
+socket or a localhost TCP port (see phaseclient.py)
+
+Each connection is served by its own thread, so many clients can send batches at once; the
+batches themselves are phased one at a time (the phasing is CPU bound, so threads could not
+run it faster anyway, and the Phaser's caches are not thread safe)
+
+Protocol: one JSON object per line each way
+    request:  {"algorithm": "hash", "genotypes": ["0120", ...], "reference": hapmap file (hash only),
+               "panel": panel file, "window": size, "overlap": 3, "time_limit": seconds, "decompose": false}
+              (all but genotypes optional; algorithm names as in PhaseRunner.algorithms)
+    response: {"phasing": [["0110", "0100"], ...], "parsimony": 3, "time": seconds}
+              or {"error": message}
+
+e.g. python phaseserver.py --socket /tmp/haplophase.sock --preload hapmap.txt:20 --packed
+
+Author: Ryan Baker
+"""
+
+from phaserunner import PhaseRunner
+from panel import ReferencePanel
+from genotypefile import parse_genotype
+from timeit import default_timer as timer
+import SocketServer
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+
+# Most genotype resolutions kept per reference panel (see PhaseService.resolutions)
+MAX_RESOLUTIONS = 1 << 20
+
+# PhaseService class: the state shared by all the connections
+class PhaseService:
+
+    def __init__(self, packed=False, vectorized=False, jobs=1):
+        self.runner = PhaseRunner(packed, vectorized, jobs)
+        self.references = {}                # maps (hapmap file, m, panel file, windowed) to reference data
+        self.resolutions = {}               # maps (hapmap file, m, panel file) to hash's resolutions against it
+        self.reference_lock = threading.Lock()
+        self.phase_lock = threading.Lock()
+        return
+
+    # The reference data for hash on m SNPs, loaded the first time it is asked for
+    # Without a panel file, the panel is built in memory (so its genotype index is kept too)
+    def reference(self, hapmapfile, m, panelfile=None, windowed=False):
+        key = (hapmapfile, m, panelfile, windowed)
+        with self.reference_lock:
+            if key not in self.references:
+                if hapmapfile is None:
+                    raise ValueError("the hash algorithm needs a hapmap file of reference phases")
+                if windowed:
+                    reference = self.runner.file_reference_phases(hapmapfile, m)
+                elif panelfile is not None:
+                    reference = self.runner.reference_panel(panelfile, hapmapfile, m)
+                else:
+                    reference = ReferencePanel.from_phases(self.runner.file_reference_phases(hapmapfile, m))
+                self.references[key] = reference
+            return self.references[key]
+
+    # The resolution hash table of hash against the (unwindowed) reference data of a hapmap file
+    # (see Phaser.phase_hash_indexed), kept between requests so that each genotype is only resolved
+    # once; it starts over once it holds MAX_RESOLUTIONS genotypes. Only used under phase_lock
+    def resolution_table(self, hapmapfile, m, panelfile=None):
+        key = (hapmapfile, m, panelfile)
+        if key not in self.resolutions or len(self.resolutions[key]) >= MAX_RESOLUTIONS:
+            self.resolutions[key] = {}
+        return self.resolutions[key]
+
+    # Phase one request (see the protocol above), returning the response
+    def phase(self, request):
+        algorithm = request.get("algorithm", "exhaustive")
+        if algorithm not in self.runner.algorithms():
+            raise ValueError("unknown algorithm %r" % algorithm)
+        genotypes = [parse_genotype(g) for g in request["genotypes"]]
+        if not genotypes or None in genotypes:
+            raise ValueError("bad genotype batch")
+        m = genotypes[0].m
+        if any(g.m != m for g in genotypes):
+            raise ValueError("genotypes in the batch have different numbers of SNPs")
+        window_size = request.get("window")
+        reference = None
+        if algorithm == "hash":
+            reference = self.reference(request.get("reference"), m, request.get("panel"), bool(window_size))
+        decompose = request.get("decompose", False)
+        with self.phase_lock:
+            resolutions = None
+            if algorithm == "hash" and not window_size and not decompose:
+                resolutions = self.resolution_table(request.get("reference"), m, request.get("panel"))
+            start_time = timer()
+            phasing, parsimony = self.runner.phase_genotypes(algorithm, genotypes, reference, window_size,
+                    request.get("overlap", 3), request.get("time_limit"), decompose, resolutions)
+            elapsed_time = timer() - start_time
+        return {"phasing": [[str(phase[0]), str(phase[1])] for phase in phasing],
+                "parsimony": parsimony, "time": elapsed_time}
+
+# Handles one connection: reads requests line by line and answers each one in turn
+class PhaseRequestHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        for line in iter(self.rfile.readline, ""):
+            if not line.strip():
+                continue
+            try:
+                response = self.server.service.phase(json.loads(line))
+            except Exception as e:
+                response = {"error": "%s: %s" % (type(e).__name__, e)}
+            self.wfile.write(json.dumps(response) + "\n")
+            self.wfile.flush()
+
+class ThreadingUnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+class ThreadingTCPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+# Make a server for the service on a Unix socket path, or else on a localhost TCP port
+def make_server(service, socket_path=None, port=None):
+    if socket_path is not None:
+        # a socket file left behind by a server which did not shut down cleanly
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = ThreadingUnixServer(socket_path, PhaseRequestHandler)
+    else:
+        server = ThreadingTCPServer(("127.0.0.1", port), PhaseRequestHandler)
+    server.service = service
+    return server
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Serve haplotype phasing requests (see phaseclient.py)")
+    parser.add_argument("--socket",
+                    help="Unix socket path to listen on")
+    parser.add_argument("--port", type=int, default=8124,
+                    help="localhost TCP port to listen on if no socket is given (default 8124)")
+    parser.add_argument("--preload", action="append", default=[], metavar="HAPMAP:M",
+                    help="load the hash reference data of a hapmap file over M SNPs at startup (can be repeated)")
+    parser.add_argument("--packed", action="store_true",
+                    help="use bit-packed haplotypes/genotypes internally (faster)")
+    parser.add_argument("--numpy", action="store_true",
+                    help="use the numpy (vectorized) backend for the greedy algorithm")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                    help="number of worker processes for windows/components/exhaustive search (default 1)")
+
+    args = parser.parse_args()
+
+    service = PhaseService(args.packed, args.numpy, args.jobs)
+    for preload in args.preload:
+        hapmapfile, m = preload.rsplit(":", 1)
+        service.reference(hapmapfile, int(m))
+
+    server = make_server(service, args.socket, args.port)
+    # shut down cleanly (removing the socket file) when killed too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket is not None and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+pool.py
+
+Module for an indexed pool of resolved (packed) haplotypes
+
+Clark's algorithm (Phaser.phase_clark) keeps asking which of the haplotypes found so far explain
+a genotype. A haplotype explains a genotype when it has the genotype's allele at every homozygous
+site, so for each SNP and allele the pool keeps the set of its haplotypes with that allele there
+(as a bitmask over their positions in the pool). The haplotypes explaining a genotype are then
+the intersection of the sets for its homozygous sites: O(m) operations on P-bit integers for a
+pool of P haplotypes, instead of an explains test against every haplotype in the pool
+
+Author: Ryan Baker
+"""
+
+from packed import snp_bit
+
+# HaplotypePool class
+class HaplotypePool:
+
+    def __init__(self, m):
+        self.m = m
+        self.haplotypes = []    # bits of the haplotypes in the pool, in the order they were added
+        self.position = {}      # maps haplotype bits to its position in haplotypes
+        # carriers[x][a] is the bitmask of the positions of the haplotypes with allele a at SNP x
+        self.carriers = [[0, 0] for x in xrange(m)]
+        return
+
+    # Add a haplotype (by its bits) to the pool, if it is not there already
+    def add(self, bits):
+        if bits in self.position:
+            return
+        position = len(self.haplotypes)
+        self.position[bits] = position
+        self.haplotypes.append(bits)
+        for x in xrange(self.m):
+            self.carriers[x][1 if bits & snp_bit(x, self.m) else 0] |= 1 << position
+
+    # The bits of the haplotypes in the pool which explain a packed genotype, in the order they were added
+    def explaining(self, genotype):
+        matches = (1 << len(self.haplotypes)) - 1
+        for x in xrange(self.m):
+            bit = snp_bit(x, self.m)
+            if genotype.het & bit:
+                continue
+            matches &= self.carriers[x][1 if genotype.alt & bit else 0]
+            if not matches:
+                return []
+        explaining = []
+        while matches:
+            lowest = matches & -matches
+            explaining.append(self.haplotypes[lowest.bit_length() - 1])
+            matches ^= lowest
+        return explaining
+
+    def __contains__(self, bits):
+        return bits in self.position
+
+    def __len__(self):
+        return len(self.haplotypes)
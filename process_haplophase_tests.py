@@ -3,26 +3,43 @@ process_haplophase_tests.py
 
 Program to process the output from the test script
 
+Reads the results file of haplophase_tests.py (default haplophase_tests.txt), or the older
+results.txt, whose lines do not have the seed and p at the end
+With several seeds per configuration, each point is the mean over them
+
+e.g. python process_haplophase_tests.py
+     python process_haplophase_tests.py results.txt
+
 Author: Ryan Baker
 """
 
+import argparse
 import matplotlib.pyplot as plt
 
 # output will be in format:
-# inputfile n m  algorithm elapsed_time correct_phases total_phases accuracy found_parsimony actual_parsimony
+# inputfile n m  algorithm elapsed_time correct_phases total_phases accuracy found_parsimony actual_parsimony [seed p]
 # def out(f, n, m, algo, t, acc, pars, real_phase_data, phasing):
 #    if not f:
 #        f = "random"
 #    print "%s %d %d %s %g %d %d %.5f %d %d" % (f, n, m, algo, t, acc[0], acc[1], acc[2], pars[0], pars[1])
 
 def main():
-    f = open("results.txt")
+
+    parser = argparse.ArgumentParser(description="Plot the results of haplophase_tests.py")
+    parser.add_argument("results", nargs="?", default="haplophase_tests.txt",
+                    help="results file (default haplophase_tests.txt)")
+
+    args = parser.parse_args()
+    f = open(args.results)
 
     x = [list() for _ in xrange(3)]
     y = [list() for _ in xrange(3)]
 
     for l in f.readlines():
         data = l.split()
+        # skip partly written lines
+        if len(data) < 10:
+            continue
         f = data[0]
         n = int(data[1])
         m = int(data[2])
@@ -37,7 +54,9 @@ def main():
         x_axis_value = m
         y_axis_value = pars
 
-        if f == "random":
+        # haplophase_tests.py always phases random data (its lines have the seed and p at the end),
+        # and records the hash reference file in the first column
+        if f == "random" or len(data) >= 12:
             if algo == "exhaustive":
                 x[0].append(x_axis_value)
                 y[0].append(y_axis_value)
@@ -48,6 +67,15 @@ def main():
                 x[2].append(x_axis_value)
                 y[2].append(y_axis_value)
 
+    # the test runner writes results in the order they finish, so sort each line by m, and
+    # average the seeds of each m
+    for i in xrange(3):
+        values = {}
+        for x_value, y_value in zip(x[i], y[i]):
+            values.setdefault(x_value, []).append(y_value)
+        x[i] = sorted(values)
+        y[i] = [float(sum(values[x_value])) / len(values[x_value]) for x_value in x[i]]
+
     plt.plot(x[0], y[0])
     plt.plot(x[1], y[1])
     plt.plot(x[2], y[2])
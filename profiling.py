@@ -0,0 +1,98 @@
+"""
+profiling.py
+
+Module for instrumenting the phasing algorithms
+
+A Profile records the wall time spent in named stages of an algorithm and counters of the
+operations it performed (haplotypes scanned, explain tests, hash probes, ...)
+Phaser uses a NullProfile unless profiling is turned on, whose methods do nothing, so the
+instrumentation costs next to nothing when it is disabled. Counters are bumped in bulk
+outside the innermost loops for the same reason
+
+Author: Ryan Baker
+"""
+
+from timeit import default_timer as timer
+
+# Context manager adding the time spent inside it to one stage of a profile
+class Stage:
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+        return
+
+    def __enter__(self):
+        self.start = timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        times = self.profile.times
+        times[self.name] = times.get(self.name, 0.0) + (timer() - self.start)
+        return False
+
+# Profile class
+class Profile:
+
+    enabled = True
+
+    def __init__(self):
+        self.counters = {}  # maps counter name to its count
+        self.times = {}     # maps stage name to the total wall time spent in it (seconds)
+        return
+
+    # Add k to a counter
+    def count(self, name, k=1):
+        self.counters[name] = self.counters.get(name, 0) + k
+
+    # Time a stage: with profile.stage("counting"): ...
+    # Stages can be nested, in which case the inner time is counted in both
+    def stage(self, name):
+        return Stage(self, name)
+
+    def reset(self):
+        self.counters = {}
+        self.times = {}
+
+    # The times and counters as a dictionary (e.g. for JSON output)
+    def as_dict(self):
+        return {"times": dict(self.times), "counters": dict(self.counters)}
+
+    def __str__(self):
+        lines = []
+        for name in sorted(self.times, key=lambda name: -self.times[name]):
+            lines.append("%-28s %12.6f s" % (name, self.times[name]))
+        for name in sorted(self.counters):
+            lines.append("%-28s %12d" % (name, self.counters[name]))
+        return "\n".join(lines)
+
+# Context manager which does nothing
+class NullStage:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+NULL_STAGE = NullStage()
+
+# Profile which records nothing (used when profiling is disabled)
+class NullProfile:
+
+    enabled = False
+
+    def count(self, name, k=1):
+        pass
+
+    def stage(self, name):
+        return NULL_STAGE
+
+    def reset(self):
+        pass
+
+    def as_dict(self):
+        return {"times": {}, "counters": {}}
+
+    def __str__(self):
+        return ""
@@ -0,0 +1,32 @@
+"""
+timelimit.py
+
+Module for cutting long computations short at a deadline
+
+A deadline is a time.time() value (or None for no deadline). The exact phasing algorithms take
+theirs on entry, and everything they run before and during their search (enumerating phases,
+the greedy phasing, building the integer program) raises TimeLimitReached once it has passed,
+so that they can return the best phasing found so far
+
+Author: Ryan Baker
+"""
+
+import time
+
+# Raised when the time limit runs out
+class TimeLimitReached(Exception):
+    pass
+
+# The items of an iterable, raising TimeLimitReached once the deadline has passed; the clock is
+# looked at before the first item and then every so many items
+# With no deadline the items are passed through as they are
+def until_deadline(items, deadline, every=4096):
+    if deadline is None:
+        return items
+    return clocked_items(items, deadline, every)
+
+def clocked_items(items, deadline, every):
+    for i, item in enumerate(items):
+        if i % every == 0 and time.time() >= deadline:
+            raise TimeLimitReached()
+        yield item
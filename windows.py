@@ -0,0 +1,63 @@
+"""
+windows.py
+
+Module for splitting genotypes into overlapping windows of SNPs and ligating
+(stitching) the phasings of adjacent windows back together
+
+Author: Ryan Baker
+"""
+
+from genotype import Genotype
+from haplotype import Haplotype
+from phase import Phase
+
+# Split m SNPs into windows of (at most) size SNPs, with overlap SNPs shared by adjacent windows
+# Returns a list of (start, end) pairs, e.g. window_bounds(10, 4, 1) = [(0, 4), (3, 7), (6, 10)]
+def window_bounds(m, size, overlap):
+    if size <= overlap:
+        raise ValueError("window size must be larger than the overlap")
+    bounds = []
+    start = 0
+    while True:
+        end = min(start + size, m)
+        bounds.append((start, end))
+        if end == m:
+            return bounds
+        start = end - overlap
+
+# The genotype restricted to SNPs [start, end)
+def slice_genotype(genotype, start, end):
+    return Genotype(genotype.data[start:end])
+
+# The phase restricted to SNPs [start, end)
+def slice_phase(phase, start, end):
+    return Phase(Haplotype(phase[0].data[start:end]), Haplotype(phase[1].data[start:end]))
+
+# Number of positions at which two lists of alleles agree
+def agreement(one, two):
+    count = 0
+    for x in xrange(len(one)):
+        if one[x] == two[x]:
+            count += 1
+    return count
+
+# Ligate the phases of one individual over consecutive windows into one phase
+# window_phases is the list of the individual's phase in each window, bounds the window bounds
+# In each overlap we keep the orientation of the new window (as is, or with its haplotypes swapped)
+# which agrees with more of the alleles phased so far, and only append its SNPs past the overlap
+# This is O(m) per individual
+def ligate(window_phases, bounds):
+    hap_one = list(window_phases[0][0].data)
+    hap_two = list(window_phases[0][1].data)
+    for w in xrange(1, len(bounds)):
+        start, end = bounds[w]
+        overlap = bounds[w - 1][1] - start
+        one = window_phases[w][0].data
+        two = window_phases[w][1].data
+        straight = agreement(hap_one[start:], one[:overlap]) + agreement(hap_two[start:], two[:overlap])
+        swapped = agreement(hap_one[start:], two[:overlap]) + agreement(hap_two[start:], one[:overlap])
+        if swapped > straight:
+            one, two = two, one
+        hap_one.extend(one[overlap:])
+        hap_two.extend(two[overlap:])
+    return Phase(Haplotype(hap_one), Haplotype(hap_two))